@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
-from src.backend import solver, Sentinel, \
-    label_to_id, id_to_label
-from src.frontend import layout, fig2d, gen_table_data
+import os
+# the solvers of a daemon record their metrics in other processes, all the
+# processes write them into a shared folder, that is read by `/metrics`,
+# it must be set before prometheus_client is imported
+if os.environ.get('AXISVM_DASH_DAEMON', None):
+    from daemon import setup_metrics
+    setup_metrics(os.environ.get('AXISVM_DASH_CACHE', '.cache'))
+from src.backend import SolverPool, ResultCache, JobManager, \
+    InfluenceEngine, ModelStore, scaling_indexes, id_to_label, label_to_id, \
+    QUEUED, DONE, FAILED, CANCELLED, NEVER, get_statistics, BUILDING, \
+    MESHING, ANALYSING, EXTRACTING, CONVERGING, MeshConvergence
+from src.backend.snapshot import load_snapshot, save_snapshot
+from src.backend.daemon import DaemonPool
+from src.backend.export import EXPORT_FORMATS, export_result
+from src.backend.metrics import timed, payload_bytes, exposition
+from src.frontend import layout, fig2d_data, fig3d, gen_table_data, \
+    get_interpolator, mesh_preview_data
 import dash
 import dash_bootstrap_components as dbc
 from dash import Dash
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
-from queue import Queue
-from threading import Thread
-import plotly.graph_objects as go
+from flask import request, Response, jsonify, abort
+import time
+import sys
+import tempfile
 
 
 # inital parameters
@@ -35,47 +50,285 @@ params = {
 }
 
 
-coords, res2d, plot_id = None, None, None
-solver_queue, plotter_queue = Queue(), Queue()
 material_names = []
-solver_thread = Thread(target=solver, 
-                       args=(solver_queue, plotter_queue, 
-                             material_names),
-                       kwargs={'visible' : False})
-solver_thread.start()
-solver_queue.put(params)
-while plotter_queue.qsize() == 0:
-    pass
-params, coords, res2d = plotter_queue.get()
-
-
-app = Dash(__name__, external_stylesheets=[dbc.themes.ZEPHYR])
-server = app.server
 timeout = 300  # I use a large value here to give AxiVM enough time to wake up
+# the number of AxisVM instances solving problems in parallel
+n_workers = int(os.environ.get('AXISVM_DASH_WORKERS', 1))
+# solutions of previous problems, the disk tier survives restarts and
+# is the store the results of the sessions are shared through between
+# the workers of the web server, see `ResultCache` for where to put it
+cache = ResultCache(max_bytes=256*2**20, 
+                    directory=os.environ.get('AXISVM_DASH_CACHE', '.cache'), 
+                    indexes=scaling_indexes, dtype='float32', mmap=True,
+                    max_disk_bytes=2*2**30)
+# 'axisvm', or 'numpy' to run without AxisVM with the NumPy backend
+backend = os.environ.get('AXISVM_DASH_BACKEND', 'axisvm')
+if backend == 'numpy':
+    from src.backend.fem import solver
+else:
+    from src.backend import solver
+# the material catalog and the key of the result of the default problem
+# from the last start, if there is a snapshot the layout is served
+# immediately, while the solvers start in the background
+snapshot_path = os.path.join(cache.directory, 'snapshot.json')
+snapshot = load_snapshot(snapshot_path, params, cache=cache, backend=backend)
+if snapshot is not None:
+    names, result_key = snapshot
+    material_names.extend(names)
+# 'never', 'on_demand' or 'write_behind', see src/backend/store.py
+persist = os.environ.get('AXISVM_DASH_PERSIST', NEVER)
+models = ModelStore('models', max_models=20)
+# the address of a solver daemon shared by the workers of the web server,
+# like 'localhost:6001', it is started if it is not running, see daemon.py
+daemon_address = os.environ.get('AXISVM_DASH_DAEMON', None)
+if daemon_address is None:
+    pool = SolverPool(n_workers, target=solver, 
+                      material_names=material_names if snapshot is None 
+                      else None,
+                      filename=os.path.join(tempfile.gettempdir(), 
+                                            params['filename']),
+                      visible=False, persist=persist, 
+                      directory=models.directory, 
+                      max_models=models.max_models)
+else:
+    spawn = [sys.executable, os.path.abspath('daemon.py'), 
+             '--address', daemon_address, '--workers', str(n_workers), 
+             '--backend', backend, '--cache', cache.directory, 
+             '--max-disk-bytes', str(cache.max_disk_bytes),
+             '--persist', persist, '--models', models.directory]
+    pool = DaemonPool(daemon_address, cache=cache, spawn=spawn, 
+                      material_names=material_names if snapshot is None 
+                      else None)
+# unit responses of a grid of patches, for instant moves of the load
+influence = InfluenceEngine(cache, shape=(16, 12), tol=0.05)
+# the coarsest mesh sizes the results converge on, by configuration
+meshes = MeshConvergence(os.path.join(cache.directory, 'meshsizes.json'),
+                         tol=0.01)
+jobs = JobManager(pool, cache=cache, influence=influence, meshes=meshes)
+
+
+if snapshot is None:
+    # the first solve also waits for AxisVM to fill in the material catalog
+    job_id = jobs.submit(params, use_cache=False)
+    jobs.result(job_id, timeout=timeout)
+    result_key = jobs[job_id].key
+    save_snapshot(snapshot_path, params, material_names, backend=backend)
+
+
+# responses are compressed with gzip or brotli, see flask-compress
+app = Dash(__name__, external_stylesheets=[dbc.themes.ZEPHYR], compress=True)
+server = app.server
 logo_src = app.get_asset_url('AxisVM-logo.png')
-app.layout = layout(material_names=material_names, logo_src=logo_src, **params)
+# models can only be saved by AxisVM
+can_save = persist != NEVER and not solver.__module__.endswith('fem')
+app.layout = layout(material_names=material_names, logo_src=logo_src, 
+                    result_key=result_key, can_save=can_save, **params)
+
+
+@server.route('/metrics')
+def metrics():
+    # see src/backend/metrics.py
+    body, content_type = exposition()
+    return Response(body, content_type=content_type)
+
+
+@server.route('/health')
+def health():
+    # the state of the solvers, 503 if one of them is dead
+    try:
+        workers = pool.health()
+    except (OSError, EOFError):
+        workers = None
+    if not workers:
+        return jsonify(workers=[]), 503
+    status = 200 if all(worker['alive'] for worker in workers) else 503
+    return jsonify(workers=workers), status
+
+
+# the messages of the stages of a solve
+STAGE_MESSAGES = {
+    BUILDING: 'Building the model...',
+    MESHING: 'Meshing...',
+    ANALYSING: 'Analysing the model ({nodes} nodes)...',
+    EXTRACTING: 'Extracting the results ({nodes} nodes)...',
+    CONVERGING: 'Refining the mesh, step {step} of at most {steps} ' 
+                '(mesh size {meshsize:.3g} m)...',
+}
+
+
+def progress_message(job_data):
+    # the status of a queued or running job
+    if job_data['status'] == QUEUED:
+        if job_data.get('position', None):
+            return 'Waiting for the solver ({} jobs ahead)...'.format(
+                job_data['position'])
+        return 'Waiting for the solver...'
+    progress = job_data.get('progress', None) or {}
+    if progress.get('stage', None) in STAGE_MESSAGES:
+        return STAGE_MESSAGES[progress['stage']].format(**progress)
+    return 'Calculating...'
+
+
+@server.route('/progress/<job_id>')
+def progress(job_id):
+    # long-poll of the state of a job, it returns when the state differs
+    # from `version`, see `progress` in assets/clientside.js
+    job = jobs.get(job_id)
+    if job is None:
+        # the job was submitted to another worker of the web server
+        return jsonify(None), 404
+    version = request.args.get('version', -1, type=int)
+    # the position in the queue changes without a new version, and a
+    # server without threads (like the sync workers of gunicorn) is
+    # blocked for everyone while the request waits
+    if not request.environ.get('wsgi.multithread', True):
+        wait = 0
+    else:
+        wait = 2 if job.status == QUEUED else 20
+    job = jobs.watch(job_id, version, timeout=wait)
+    job_data = dict(job.to_dict(), position=jobs.position(job_id))
+    job_data['message'] = progress_message(job_data)
+    if request.args.get('mesh', 0, type=int) and job.preview is not None:
+        with timed('preview'):
+            job_data['mesh'] = mesh_preview_data(*job.preview)
+    return jsonify(job_data)
+
+
+@server.route('/export/<key>.<fmt>')
+def export(key, fmt):
+    # streams a result from the store without solving it again, in 
+    # chunks, see src/backend/export.py
+    result = cache.get(key) if fmt in EXPORT_FORMATS else None
+    if result is None:
+        abort(404)
+    labels = [id_to_label[i] for i in range(len(result[3]))]
+    _, mimetype, ext = EXPORT_FORMATS[fmt]
+    filename = 'AxisVM-Dash-{}{}'.format(key[:12], ext)
+    return Response(export_result(result, fmt, labels=labels), 
+                    mimetype=mimetype, headers={
+                        'Content-Disposition': 
+                            'attachment; filename={}'.format(filename)})
+
+
+@server.after_request
+def measure_payload(response):
+    # runs before the compression of the response
+    if request.path.endswith('_dash-update-component') and \
+            response.status_code == 200:
+        output = request.get_json(silent=True) or {}
+        payload_bytes.labels(output=output.get('output', '')).observe(
+            response.calculate_content_length() or 0)
+    return response
 
 
 @app.callback(
-    Output('plot', 'figure'),
+    Output('fields', 'data'),
     Output('table', 'data'),
-    Input('component', 'value')
+    Input('result', 'data')
 )
-def update(comp):
-    global params, coords, res2d, plot_id
-    if coords is not None and res2d is not None:        
-        plot_id = label_to_id[comp]
-        fig = fig2d(coords, res2d[plot_id, :], cmap="Viridis", **params)
+def update(key):
+    # the arrays are fetched from the store, only the key is in the browser
+    result = cache.get(key) if key is not None else None
+    if result is not None:
+        params_, coords, topo, res2d = result
+        # all the components are sent at once, see assets/clientside.js
+        with timed('fig2d'):
+            interpolator = get_interpolator(key, coords, topo, 
+                                            resolution=200)
+            labels = [id_to_label[i] for i in range(len(res2d))]
+            fields = fig2d_data(coords, topo, res2d, labels, 
+                                interpolator=interpolator)
     else:
-        fig = go.Figure()
-    table_data = gen_table_data(res2d=res2d, **params)
-    return fig, table_data.to_dict('records')
+        params_, fields = params, None
+    with timed('table'):
+        # the statistics are evaluated once per result
+        stats = None if result is None else \
+            get_statistics(key, coords, topo, res2d)
+        table_data = gen_table_data(stats=stats, **params_)
+    return fields, table_data
+
+
+# the progress of the running job is long-polled from `/progress` by
+# the browser and shown with a preview of the mesh, until the result
+# arrives, the poll interval hands the latest state to Dash
+app.clientside_callback(
+    ClientsideFunction(namespace='plotting', function_name='progress'),
+    Output('progress', 'data'),
+    Input('job', 'data'),
+    Input('poll', 'n_intervals'),
+    State('progress', 'data'),
+)
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='plotting', function_name='preview'),
+    Output('status', 'children', allow_duplicate=True),
+    Output('plot', 'figure', allow_duplicate=True),
+    Input('progress', 'data'),
+    prevent_initial_call=True
+)
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='plotting', function_name='exports'),
+    Output('export_npz', 'href'),
+    Output('export_vtk', 'href'),
+    Output('export_csv', 'href'),
+    Input('result', 'data')
+)
+
+
+# the plot and the selection in the table are handled in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='plotting', function_name='fig2d'),
+    Output('plot', 'figure'),
+    Input('component', 'value'),
+    Input('fields', 'data'),
+    Input('view', 'value')
+)
 
 
 @app.callback(
+    Output('plot', 'figure', allow_duplicate=True),
+    Input('view', 'value'),
+    Input('component', 'value'),
+    # a new result has arrived
+    Input('fields', 'data'),
+    State('result', 'data'),
+    prevent_initial_call=True
+)
+def update3d(view, component, fields, key):
+    # the deformed shape, large meshes are decimated for the browser
+    result = cache.get(key) if view == '3d' and key is not None else None
+    if result is None:
+        raise PreventUpdate
+    params_, coords, topo, res2d = result
+    Lx, Ly = params_['size']
+    with timed('fig3d'):
+        return fig3d(coords, topo, res2d[label_to_id[component]], 
+                     uz=res2d[label_to_id['UZ']], max_elements=20000, 
+                     Lx=Lx, Ly=Ly)
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='plotting', function_name='select'),
     Output('component', 'value'),
-    Input('calc_button', 'n_clicks'),
     Input('table', 'active_cell'),
+    State('component', 'value'),
+    State('table', 'data'),
+    prevent_initial_call=True
+)
+
+
+@app.callback(
+    Output('job', 'data'),
+    Output('result', 'data'),
+    Output('poll', 'disabled'),
+    Output('status', 'children'),
+    Input('calc_button', 'n_clicks'),
+    Input('precompute_button', 'n_clicks'),
+    Input('save_button', 'n_clicks'),
+    Input('poll', 'n_intervals'),
     # geom
     State('Lx', 'value'),
     State('Ly', 'value'),
@@ -90,50 +343,121 @@ def update(comp):
     State('q', 'value'),
     # mesh
     State('meshsize', 'value'),
-    # results
-    State('component', 'value'),
+    State('converge', 'value'),
+    State('approximate', 'value'),
+    # the running job
+    State('job', 'data'),
     prevent_initial_call=True    
 )
-def recalc(n_clicks, active_cell, Lx, Ly, t, material, 
-           xc, yc, w, h, q, meshsize, comp):
+def recalc(n_clicks, n_precompute, n_save, n_intervals, Lx, Ly, t, 
+           material, xc, yc, w, h, q, meshsize, converge, approximate, 
+           job_data):
     
     # determine wich input fired
     ctx = dash.callback_context
-    if not ctx.triggered:
-        # we can get here from initial render
-        pass
-    else:
-        ctx_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    if ctx_id == 'table':
-        # the user clicked on the table
-        global plot_id
-        if active_cell['row'] == plot_id:
-            # no need to update plot
-            raise PreventUpdate
-        comp = id_to_label[active_cell['row']]
-        return comp
+    ctx_id = ctx.triggered[0]['prop_id'].split('.')[0]
+    if ctx_id in ('calc_button', 'precompute_button', 'save_button'):
+        new_params = dict(params)
+        new_params.update({
+            'material' : material,
+            'size' : (Lx, Ly),
+            'thickness' : t,
+            'load' : {'xc' : xc, 'yc': yc, 
+                    'w' : w, 'h': h, 'q' : q},
+            'meshsize' : meshsize,
+        })
+    if ctx_id == 'calc_button':
+        # the user clicked on 'Calculate', submit a new job, that replaces
+        # the calculation the user is waiting for
+        supersedes = None
+        if job_data is not None and not job_data.get('precompute', False) \
+                and not job_data.get('save', False):
+            supersedes = job_data['id']
+        if converge:
+            # the mesh size is chosen by refinement, or known from before
+            job_id = jobs.converge(new_params, approximate=approximate)
+        else:
+            job_id = jobs.submit(new_params, approximate=approximate, 
+                                 supersedes=supersedes)
+        job_data = jobs[job_id].to_dict()
+    elif ctx_id == 'precompute_button':
+        # the result is not shown, only kept in the cache
+        job_id = jobs.precompute(new_params)
+        job_data = dict(jobs[job_id].to_dict(), precompute=True)
+    elif ctx_id == 'save_button':
+        if new_params in models:
+            return None, dash.no_update, True, \
+                'The model is saved as {}.'.format(models.path(new_params))
+        job_id = jobs.save(new_params)
+        job_data = dict(jobs[job_id].to_dict(), save=True)
+    if job_data is None:
+        raise PreventUpdate
     
-    # if we are here, the user clicked on 'Calculate'
-    global params, solver_queue, plotter_queue, coords, res2d
-    new_params = {
-        'material' : material,
-        'size' : (Lx, Ly),
-        'thickness' : t,
-        'load' : {'xc' : xc, 'yc': yc, 
-                'w' : w, 'h': h, 'q' : q},
-        'meshsize' : meshsize,
-    }
-    params.update(new_params)
-    solver_queue.put(params)
-    while plotter_queue.qsize() == 0:
-        pass
-    params, coords, res2d = plotter_queue.get()
-    return comp
+    # report the state of the job
+    job = jobs.get(job_data['id'])
+    # the key of the result may differ from the one of the submitted
+    # problem, like for a converged mesh or the result of a batch
+    key, info = job_data['key'], job_data['info']
+    if job is not None:
+        status, error = job.status, job.error
+        key, info = job.key, job.info
+    elif job_data['key'] in cache:
+        # the job was run by another worker of the web server
+        status, error = DONE, None
+    else:
+        status, error = job_data['status'], job_data['error']
+    if status == FAILED:
+        return None, dash.no_update, True, \
+            'The calculation failed: {}'.format(error)
+    if status == CANCELLED:
+        return None, dash.no_update, True, ''
+    if status == DONE:
+        if job_data.get('precompute', False):
+            return None, dash.no_update, True, \
+                'The influence surfaces are ready.'
+        if job_data.get('save', False):
+            path = models.path(job_data['key'])
+            return None, key, True, \
+                'The model is saved as {}.'.format(path)
+        if info is not None and 'history' in info:
+            if info['converged']:
+                message = 'Converged with a mesh size of {:.3g} m'.format(
+                    info['meshsize'])
+                if info['history']:
+                    message += ' in {} steps'.format(len(info['history']))
+                if info.get('remembered', False):
+                    # the mesh size was found by an earlier calculation
+                    message += ', found earlier for this configuration'
+                return None, key, True, message + '.'
+            return None, key, True, \
+                'Not converged in {} steps (last change {:.1%}), the ' \
+                'result of the finest mesh is shown.'.format(
+                    len(info['history']), info['history'][-1]['change'])
+        if info is not None and info.get('influence', False):
+            return None, key, True, \
+                'Approximate result from the influence surfaces ' + \
+                '(estimated error {:.1%}).'.format(info['error'])
+        if info is not None and info['approximate']:
+            return None, key, True, \
+                'Approximate result, scaled from a solution with ' + \
+                'a different material or thickness.'
+        return None, key, True, ''
+    if time.time() - job_data['submitted'] > timeout:
+        return None, dash.no_update, True, 'The calculation timed out.'
+    if ctx_id == 'poll':
+        # the job in the browser is not replaced while it runs, it would
+        # restart the stream of the progress
+        job_data, message = dash.no_update, progress_message(
+            job_data if job is None else 
+            dict(job.to_dict(), position=jobs.position(job.id)))
+    else:
+        message = progress_message(job_data)
+    return job_data, dash.no_update, False, message
 
 
 if __name__ == '__main__':
     try:
         app.run_server(debug=False, port=8888)
     finally:
-        solver_queue.put(Sentinel())
-        solver_thread.join()
+        pool.close()
+        jobs.close()
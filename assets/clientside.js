@@ -0,0 +1,182 @@
+// Callbacks running in the browser. The server only sends the results
+// of a new solve, switching between the components happens here.
+var TYPED_ARRAYS = {
+    f4: Float32Array, f8: Float64Array,
+    i1: Int8Array, i2: Int16Array, i4: Int32Array,
+    u1: Uint8Array, u2: Uint16Array, u4: Uint32Array
+};
+
+
+// the final states of a job, see src/backend/jobs.py
+var FINISHED = ['done', 'failed', 'cancelled'];
+
+
+// decodes an array encoded by `encode_array` in src/frontend/encoding.py,
+// 2d arrays are returned as arrays of rows
+function decode(data) {
+    var bytes = Uint8Array.from(atob(data.bdata), function(c) {
+        return c.charCodeAt(0);
+    });
+    var values = new TYPED_ARRAYS[data.dtype](bytes.buffer);
+    if (data.shape.length < 2) {
+        return values;
+    }
+    var n = data.shape[1], rows = [];
+    for (var i = 0; i < data.shape[0]; i++) {
+        rows.push(values.subarray(i * n, (i + 1) * n));
+    }
+    return rows;
+}
+
+
+// the job watched by `watch` and its last state
+var watched = {id: null, data: null};
+
+
+function sleep(ms) {
+    return new Promise(function(resolve) {
+        setTimeout(resolve, ms);
+    });
+}
+
+
+// long-polls the state of a job from `/progress` (see app.py) until it
+// is finished or another job is watched. It runs outside of the callbacks,
+// Dash drops a running callback if it is triggered again.
+async function watch(id) {
+    watched.id = id;
+    watched.data = null;
+    var version = -1, mesh = null;
+    while (watched.id === id) {
+        var url = 'progress/' + id + '?version=' + version +
+            (mesh ? '' : '&mesh=1');
+        var data;
+        try {
+            var response = await fetch(url);
+            if (!response.ok) {
+                // the job is run by another worker of the web server,
+                // only the polling of `recalc` reports its state
+                return;
+            }
+            data = await response.json();
+        } catch (e) {
+            await sleep(1000);
+            continue;
+        }
+        if (watched.id !== id) {
+            return;
+        }
+        var news = data.version !== version;
+        data.mesh = data.mesh || mesh;
+        // the position in the queue changes without a new version
+        data.received = Date.now();
+        watched.data = data;
+        version = data.version;
+        mesh = data.mesh;
+        if (FINISHED.indexOf(data.status) >= 0) {
+            return;
+        }
+        if (!news) {
+            // a server without threads answers immediately
+            await sleep(1000);
+        }
+    }
+}
+
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    plotting: {
+        // the client side version of `fig2d` in src/frontend/plotting.py,
+        // the 3d view is drawn by `update3d` in app.py
+        fig2d: function(comp, fields, view) {
+            if (view === '3d') {
+                return window.dash_clientside.no_update;
+            }
+            if (!fields || !(comp in fields.z)) {
+                return {data: [], layout: {}};
+            }
+            return {
+                data: [{
+                    type: 'contour',
+                    x: decode(fields.x),
+                    y: decode(fields.y),
+                    z: decode(fields.z[comp]),
+                    zmin: fields.zmin[comp],
+                    zmax: fields.zmax[comp]
+                }],
+                layout: {
+                    xaxis: {showticklabels: false},
+                    yaxis: {scaleanchor: 'x', showticklabels: false},
+                    paper_bgcolor: 'white',
+                    plot_bgcolor: 'white'
+                }
+            };
+        },
+        // the addresses of the exports of the result, see `/export` in app.py
+        exports: function(key) {
+            if (!key) {
+                return [null, null, null];
+            }
+            return ['npz', 'vtk', 'csv'].map(function(fmt) {
+                return 'export/' + key + '.' + fmt;
+            });
+        },
+        // the user clicked on the table
+        select: function(active_cell, comp, data) {
+            if (!active_cell || !data) {
+                return window.dash_clientside.no_update;
+            }
+            var label = data[active_cell.row][''];
+            if (label === comp) {
+                // no need to update plot
+                return window.dash_clientside.no_update;
+            }
+            return label;
+        },
+        // hands the state of the running job fetched by `watch` to Dash,
+        // at the ticks of the poll interval, see `recalc` in app.py
+        progress: function(job, n_intervals, progress) {
+            var no_update = window.dash_clientside.no_update;
+            if (!job || !job.id) {
+                watched.id = null;
+                return progress ? null : no_update;
+            }
+            if (watched.id !== job.id) {
+                watch(job.id);
+            }
+            var data = watched.data;
+            if (!data || (progress && progress.received === data.received)) {
+                return no_update;
+            }
+            return data;
+        },
+        // the progress of the running job with a preview of the mesh
+        preview: function(progress) {
+            var no_update = window.dash_clientside.no_update;
+            if (!progress || FINISHED.indexOf(progress.status) >= 0) {
+                return [no_update, no_update];
+            }
+            if (!progress.mesh) {
+                return [progress.message, no_update];
+            }
+            return [progress.message, {
+                data: [{
+                    type: 'scattergl',
+                    mode: 'lines',
+                    x: decode(progress.mesh.x),
+                    y: decode(progress.mesh.y),
+                    line: {width: 1, color: 'gray'},
+                    hoverinfo: 'skip'
+                }],
+                layout: {
+                    xaxis: {showticklabels: false, showgrid: false,
+                            zeroline: false},
+                    yaxis: {scaleanchor: 'x', showticklabels: false,
+                            showgrid: false, zeroline: false},
+                    paper_bgcolor: 'white',
+                    plot_bgcolor: 'white'
+                }
+            }];
+        }
+    }
+});
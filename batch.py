@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch runner for parametric sweeps.
+
+The sweep is described in a JSON file, see `expand_sweep` in
+src/backend/sweep.py. For example, to move the patch load over a grid:
+
+    {
+        "base": {... the parameters of the problem, like in app.py ...},
+        "grid": {"load.xc": [1, 2, 3, 4, 5, 6, 7],
+                 "load.yc": [1, 2, 3, 4, 5]}
+    }
+
+Usage:
+
+    >>> python batch.py sweep.json -o results --workers 2
+
+Running the same command again resumes an interrupted sweep.
+"""
+from src.backend import SolverPool, JobManager, ResultCache, id_to_label
+from src.backend.daemon import DaemonPool
+from src.backend.sweep import run_sweep, expand_sweep, NpzWriter, \
+    ParquetWriter
+import argparse
+import json
+import sys
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('spec', help='JSON file describing the sweep')
+    parser.add_argument('-o', '--output', default='results',
+                        help='output folder (default: results)')
+    parser.add_argument('-f', '--format', choices=['npz', 'parquet'],
+                        default='npz', help='output format (default: npz)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of solver workers (default: 1)')
+    parser.add_argument('-b', '--backend', choices=['axisvm', 'numpy'],
+                        default='axisvm', help='solver (default: axisvm)')
+    parser.add_argument('--max-batch', type=int, default=32,
+                        help='load cases solved in one model (default: 32)')
+    parser.add_argument('--persist', choices=['never', 'write_behind'],
+                        default='never',
+                        help='keep the AxisVM models (default: never)')
+    parser.add_argument('--models', default='models',
+                        help='folder of the kept models (default: models)')
+    parser.add_argument('--cache', default=None,
+                        help='folder of the result cache (default: none)')
+    parser.add_argument('--daemon', default=None,
+                        help='address of a solver daemon to use instead of '
+                        'solving in this process, see daemon.py')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='solve the variants already in the output')
+    args = parser.parse_args(argv)
+
+    with open(args.spec, 'r') as f:
+        spec = json.load(f)
+    n = len(expand_sweep(spec))
+
+    if args.backend == 'numpy':
+        from src.backend.fem import solver
+    else:
+        from src.backend import solver
+    if args.format == 'parquet':
+        writer = ParquetWriter(args.output, labels=list(id_to_label.values()))
+    else:
+        writer = NpzWriter(args.output)
+    cache = None if args.cache is None else ResultCache(directory=args.cache)
+    if args.daemon is None:
+        pool = SolverPool(args.workers, target=solver, visible=False,
+                          max_batch=args.max_batch, persist=args.persist,
+                          directory=args.models)
+    else:
+        pool = DaemonPool(args.daemon)
+    jobs = JobManager(pool, cache=cache)
+
+    t0 = time.time()
+    def report(i, job):
+        print('[{:.1f}s] variant {}/{}: {}'.format(time.time() - t0, i + 1, n,
+                                                  job.status))
+    try:
+        summary = run_sweep(spec, jobs, writer, resume=not args.no_resume,
+                            callback=report)
+    finally:
+        pool.close()
+        jobs.close()
+    print('{done} done, {failed} failed, {skipped} skipped'.format(**summary))
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the extraction of results and the rendering of figures.
+
+The stages that talk to AxisVM (`get_results`, and the conversion of the
+nodes and the triangles in `generate_mesh`) are run against a stand-in of
+the COM interface, that serves synthetic records shaped like the ones of
+AxisVM, so the suite runs without AxisVM. The meshes are generated by the
+NumPy backend and the nodal results are synthetic.
+
+The time of every stage is the best of the repeats, and its peak memory
+is measured in a separate run with `tracemalloc`. The results are written
+to a JSON file, that can be compared with the results of another version:
+
+    >>> python benchmark.py -o after.json --compare before.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+import numpy as np
+
+
+STAGES = ['get_results', 'get_element_results', 'generate_mesh', 'smoothing',
+          'fig2d', 'fig3d', 'fig3d_decimated', 'statistics', 'gen_table_data', 
+          'float_to_str_sig']
+
+
+class Record:
+    """
+    Stands in for the records and the type library constants of AxisVM.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def install_com_stand_in():
+    """
+    Makes `src.backend.backend` importable if AxisVM is not installed.
+    """
+    try:
+        import axisvm.com.tlb
+        import axisvm.com.client
+        return
+    except ImportError:
+        pass
+    class TypeLibrary(types.ModuleType):
+        def __getattr__(self, name):
+            if name.startswith('__'):
+                raise AttributeError(name)
+            return Record
+    tlb = TypeLibrary('axisvm.com.tlb')
+    client = types.ModuleType('axisvm.com.client')
+    client.start_AxisVM = None
+    com = types.ModuleType('axisvm.com')
+    com.tlb, com.client = tlb, client
+    axisvm = types.ModuleType('axisvm')
+    axisvm.com = com
+    sys.modules.update({'axisvm': axisvm, 'axisvm.com': com,
+                        'axisvm.com.tlb': tlb, 'axisvm.com.client': client})
+
+
+class ComModel:
+    """
+    The parts of an AxisVM model used by `generate_mesh` and `get_results`,
+    serving records prepared in advance, as if the model was meshed and
+    analysed.
+    """
+
+    def __init__(self, coords, topo, res2d, eres=None):
+        nodes = [Record(x=x, y=y, z=z) for x, y, z in coords.tolist()]
+        surfaces = [Record(points=(t, len(t))) for t in (topo + 1).tolist()]
+        for s in surfaces:
+            s.GetContourPoints = (lambda s: lambda: s.points)(s)
+        disps = [Record(ez=ez, Fx=fx, Fy=fy) 
+                 for ez, fx, fy in res2d.T.tolist()]
+        domain = Record(MeshSurfaceIds=list(range(1, len(topo) + 1)),
+                        GenerateMesh=lambda params: None)
+        class Nodes(list):
+            Count = len(nodes)
+            def BulkGetCoord(self, ids):
+                return [self[i-1] for i in ids], len(ids)
+        class Items:
+            def __getitem__(self, i):
+                return surfaces[i-1]
+        class Domains:
+            def __getitem__(self, i):
+                return domain
+        self.Nodes = Nodes(nodes)
+        self.Surfaces = Record(Item=Items())
+        self.Domains = Domains()
+        displacements = Record(AllNodalDisplacementsByLoadCaseId=lambda:
+                               (disps, len(disps)))
+        # one record per corner of every triangle
+        fields = ('mx', 'my', 'mxy', 'vxz', 'vyz')
+        vertices = [] if eres is None else \
+            [Record(**dict(zip(fields, values))) for values in 
+             eres.transpose(1, 2, 0).reshape(-1, len(fields)).tolist()]
+        forces = Record(AllSurfaceVertexForcesByLoadCaseId=lambda:
+                        (vertices, len(vertices)))
+        self.Results = Record(Displacements=displacements, Forces=forces)
+
+
+def synthetic_problem(n_nodes):
+    """
+    Returns the coordinates, the topology and synthetic nodal results
+    of a mesh of the default plate with about `n_nodes` nodes.
+    """
+    from src.backend.fem import PlateModel, build, generate_mesh
+    Lx, Ly = 8., 6.
+    meshsize = np.sqrt(Lx * Ly / n_nodes)
+    params = {'material': 'C16/20', 'size': (Lx, Ly), 'thickness': 0.2,
+              'load': {'xc': 5., 'yc': 4., 'w': .5, 'h': 1., 'q': -200.},
+              'support': {}, 'meshsize': meshsize}
+    axmodel = PlateModel()
+    build(axmodel=axmodel, **params)
+    coords, topo = generate_mesh(axmodel=axmodel, **params)
+    x, y = coords[:, 0] / Lx, coords[:, 1] / Ly
+    uz = -np.sin(np.pi * x) * np.sin(np.pi * y) * 1e-3
+    rotx = np.sin(np.pi * x) * np.cos(np.pi * y) * 1e-4
+    roty = -np.cos(np.pi * x) * np.sin(np.pi * y) * 1e-4
+    return params, coords, topo, np.stack([uz, rotx, roty])
+
+
+def stages(params, coords, topo, res2d, selected=STAGES):
+    """
+    Returns the benchmarked stages as functions without arguments.
+    """
+    from src.backend import backend
+    from src.backend.smoothing import smoothing_operator, smooth
+    from src.backend.statistics import result_statistics
+    from src.frontend import fig2d, fig3d, gen_table_data
+    from src.frontend.utils import float_to_str_sig
+    tri = topo[:, :3]
+    # synthetic internal forces at the corners of the triangles
+    eres = res2d[[0, 1, 2, 1, 2]][:, tri]
+    # the records of the forces are only created if they are needed
+    axmodel = ComModel(coords, topo, res2d, eres=eres if 
+                       'get_element_results' in selected else None)
+    Lx, Ly = params['size']
+    # the table is generated from cached statistics
+    stats = result_statistics(coords, topo, res2d) if \
+        'gen_table_data' in selected else None
+    return {
+        'get_results': lambda: backend.get_results(axmodel=axmodel),
+        'get_element_results': lambda: backend.get_element_results(
+            axmodel=axmodel),
+        'smoothing': lambda: smooth(smoothing_operator(coords, topo), eres),
+        'generate_mesh': lambda: backend.generate_mesh(axmodel=axmodel,
+                                                       meshsize=1.),
+        'fig2d': lambda: fig2d(coords, topo, res2d[0]),
+        'fig3d': lambda: fig3d(coords, tri, res2d[0], uz=res2d[0], Lx=Lx,
+                               Ly=Ly),
+        'fig3d_decimated': lambda: fig3d(coords, tri, res2d[0], uz=res2d[0],
+                                         max_elements=20000, Lx=Lx, Ly=Ly),
+        'statistics': lambda: result_statistics(coords, topo, res2d),
+        'gen_table_data': lambda: gen_table_data(stats=stats),
+        'float_to_str_sig': lambda: float_to_str_sig(res2d[0]),
+    }
+
+
+def measure(func, repeat=1, memory=True):
+    seconds = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - t0)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return min(seconds), peak
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit': commit or None, 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(results, reference):
+    # speedups of the stages measured in both runs
+    ref = {(r['stage'], r['nodes']): r for r in reference['results']}
+    for r in results['results']:
+        other = ref.get((r['stage'], r['nodes']), None)
+        if other is None or r['seconds'] is None or not other['seconds']:
+            continue
+        print('{:>18} {:>9} nodes: {:8.3f}s -> {:8.3f}s ({:.2f}x)'.format(
+            r['stage'], r['nodes'], other['seconds'], r['seconds'],
+            other['seconds'] / r['seconds']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', '--nodes', type=float, nargs='+',
+                        default=[1e3, 1e4, 1e5, 1e6],
+                        help='approximate node counts (default: 1e3 to 1e6)')
+    parser.add_argument('-s', '--stages', nargs='+', choices=STAGES,
+                        default=STAGES, help='stages (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='timed runs per stage (default: 3)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the measurement of the peak memory')
+    parser.add_argument('-o', '--output', default='benchmark.json',
+                        help='output file (default: benchmark.json)')
+    parser.add_argument('--compare', default=None,
+                        help='results of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    install_com_stand_in()
+    results = dict(environment(), results=[])
+    for n in args.nodes:
+        problem = synthetic_problem(int(n))
+        _, coords, topo, _ = problem
+        funcs = stages(*problem, selected=args.stages)
+        for stage in args.stages:
+            record = {'stage': stage, 'nodes': len(coords),
+                      'elements': len(topo), 'seconds': None,
+                      'peak_bytes': None, 'error': None}
+            try:
+                seconds, peak = measure(funcs[stage], repeat=args.repeat,
+                                        memory=not args.no_memory)
+            except Exception as e:
+                # a failing stage is recorded, the others are still measured
+                record['error'] = repr(e)
+                print('{:>18} {:>9} nodes: {}'.format(stage, len(coords),
+                                                      record['error']))
+            else:
+                record.update(seconds=seconds, peak_bytes=peak)
+                print('{:>18} {:>9} nodes: {:8.3f}s {:>10}'.format(
+                    stage, len(coords), seconds,
+                    '' if peak is None else '{:.1f}MB'.format(peak / 2**20)))
+            results['results'].append(record)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
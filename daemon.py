@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Solver daemon shared by the workers of the web server.
+
+The solvers run in worker processes of the daemon, that are restarted if
+they die or if a job takes longer than the timeout, see
+src/backend/daemon.py. The results are stored in the result cache, set
+the same folder for the app (`AXISVM_DASH_CACHE`).
+
+Usage:
+
+    >>> python daemon.py --address localhost:6001 --workers 2
+
+The app connects to it, if `AXISVM_DASH_DAEMON` is set to the address.
+The connections are authenticated with `AXISVM_DASH_AUTHKEY`, or with a
+random key in ~/.axisvm-dash-authkey, only readable by the user.
+"""
+import argparse
+import glob
+import os
+import sys
+
+
+def _alive(pid):
+    if os.name == 'nt':
+        # the files of running processes are mapped, they cannot be
+        # removed anyway
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def setup_metrics(cache='.cache'):
+    """
+    Sets the folder the processes of the app and of the daemon write
+    their metrics into (`PROMETHEUS_MULTIPROC_DIR`, default is 'metrics'
+    in the folder of the results), and removes the files of the processes
+    that are gone. It must be called before prometheus_client is imported.
+    """
+    directory = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                      os.path.join(cache, 'metrics'))
+    os.makedirs(directory, exist_ok=True)
+    # the files are named like counter_<pid>.db
+    for path in glob.glob(os.path.join(directory, '*_*.db')):
+        try:
+            pid = int(os.path.basename(path)[:-3].rsplit('_', 1)[1])
+        except ValueError:
+            continue
+        if _alive(pid):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-a', '--address', default='localhost:6001',
+                        help='address to listen on (default: localhost:6001)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of solver processes (default: 1)')
+    parser.add_argument('-b', '--backend', choices=['axisvm', 'numpy'],
+                        default='axisvm', help='solver (default: axisvm)')
+    parser.add_argument('-t', '--timeout', type=float, default=300.,
+                        help='seconds a job may take before its solver is '
+                        'restarted (default: 300)')
+    parser.add_argument('--cache', default='.cache',
+                        help='folder of the results (default: .cache)')
+    parser.add_argument('--max-disk-bytes', type=int, default=2*2**30,
+                        help='size limit of the folder of the results, '
+                        'the least recently used are removed first '
+                        '(default: 2 GB)')
+    parser.add_argument('--max-batch', type=int, default=32,
+                        help='load cases solved in one model (default: 32)')
+    parser.add_argument('--persist',
+                        choices=['never', 'on_demand', 'write_behind'],
+                        default='never',
+                        help='keep the AxisVM models (default: never)')
+    parser.add_argument('--models', default='models',
+                        help='folder of the kept models (default: models)')
+    args = parser.parse_args(argv)
+
+    # the metrics of the daemon and of its workers are written into a
+    # folder shared with the app
+    setup_metrics(args.cache)
+    from src.backend.daemon import SolverDaemon
+    if args.backend == 'numpy':
+        from src.backend.fem import solver
+    else:
+        from src.backend import solver
+    try:
+        daemon = SolverDaemon(args.address, n_workers=args.workers,
+                              target=solver, cache_directory=args.cache,
+                              max_disk_bytes=args.max_disk_bytes,
+                              timeout=args.timeout,
+                              visible=False, max_batch=args.max_batch,
+                              persist=args.persist, directory=args.models)
+    except OSError as e:
+        # another daemon listens on the address
+        print('Cannot listen on {}: {}'.format(args.address, e))
+        return 1
+    print('Listening on {} with {} workers'.format(args.address, args.workers))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,15 @@
 # -*- coding: utf-8 -*-
-from src.backend.backend import *
-
+from src.backend.labels import *
+from src.backend.jobs import *
+from src.backend.cache import *
+from src.backend.pool import *
+from src.backend.scaling import *
+from src.backend.influence import *
+from src.backend.store import *
+from src.backend.statistics import *
+from src.backend.convergence import *
+try:
+    from src.backend.backend import *
+except ImportError:
+    # AxisVM is not available, only src.backend.fem can be used
+    pass
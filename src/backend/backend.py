@@ -6,23 +6,95 @@ from axisvm.com.tlb import RSurfaceAttr, lnlTensionAndCompression, \
     RNonLinearityXYZ, dofPlateXY, lgtStraightLine, RLineGeomData, \
     RLoadDomainPolyArea, dtGlobal, ldtConst, RResistances, RNonLinearity, \
     RStiffnesses, dsGlobal, ndcEuroCode
+from contextlib import contextmanager
+from operator import attrgetter
+import ctypes
 import numpy as np
+from .jobs import Sentinel, serve, no_progress, BUILDING, MESHING, \
+    ANALYSING, EXTRACTING
+from .store import ModelStore, NEVER, WRITE_BEHIND
+from .metrics import timed, mesh_nodes, mesh_elements, com_calls, \
+    solver_restarts
+from .labels import dofs, id_to_label, label_to_id
+from .smoothing import smoothing_operator, smooth
 
 
 __all__ = ['solver', 'Sentinel', 'dofs', 'id_to_label', 'label_to_id', \
     'get_material_names']
 
 
-dofs = UZ, ROTX, ROTY = list(range(3))
-id_to_label = {UZ: 'UZ', ROTX: 'ROTX', ROTY: 'ROTY'}
-label_to_id = {value: key for key, value in id_to_label.items()}
+# values returned by COM calls that are not COM objects, they are not
+# wrapped by `_Counted`
+_DATA = (type(None), bool, int, float, complex, str, bytes, tuple, list,
+         dict, np.ndarray, np.generic, ctypes.Structure, ctypes.Array)
 
 
-class Sentinel: ...
+class _Counted:
+    """
+    A thin proxy of a COM object, that counts the calls made through it
+    and through the COM objects it returns in `counts[0]`. Calls of
+    methods, property reads and writes, indexing and `len` are counted.
+    """
+
+    __slots__ = ('_obj', '_counts')
+
+    def __init__(self, obj, counts):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_counts', counts)
+
+    def _wrap(self, value):
+        if isinstance(value, _DATA):
+            return value
+        return _Counted(value, self._counts)
+
+    def __getattr__(self, name):
+        value = getattr(self._obj, name)
+        if not callable(value):
+            # a property read, methods are counted when they are called
+            self._counts[0] += 1
+        return self._wrap(value)
+
+    def __setattr__(self, name, value):
+        self._counts[0] += 1
+        setattr(self._obj, name, _unwrap(value))
+
+    def __getitem__(self, index):
+        self._counts[0] += 1
+        return self._wrap(self._obj[index])
+
+    def __len__(self):
+        self._counts[0] += 1
+        return len(self._obj)
+
+    def __call__(self, *args, **kwargs):
+        self._counts[0] += 1
+        args = [_unwrap(a) for a in args]
+        kwargs = {k: _unwrap(v) for k, v in kwargs.items()}
+        return self._wrap(self._obj(*args, **kwargs))
+
+
+def _unwrap(value):
+    return value._obj if isinstance(value, _Counted) else value
+
+
+@contextmanager
+def counted(stage, *objects):
+    """
+    Returns a context manager that gives proxies of COM objects, and
+    records the number of COM calls made through them in `com_calls`.
+
+    Example
+    -------
+    >>> with counted('mesh', axmodel) as (model,):
+    ...     coords, topo = generate_mesh(axmodel=model, **params)
+    """
+    counts = [0]
+    yield tuple(_Counted(obj, counts) for obj in objects)
+    com_calls.labels(stage=stage).observe(counts[0])
 
 
 def build(*args, axapp, axmodel, material, size, 
-          thickness, load, support, **kwargs):
+          thickness, support, load=None, loads=None, **kwargs):
     
     axmodel.Settings.NationalDesignCode = ndcEuroCode
     matId = axmodel.Materials.AddFromCatalog(ndcEuroCode, material) 
@@ -66,6 +138,36 @@ def build(*args, axapp, axmodel, material, size,
         )
     axmodel.Domains.Add(LineIds=lineIDs, SurfaceAttr=sattr)
     
+    # add path load(s), every load is in its own load case
+    if loads is None:
+        loads = [load]
+    for i, load in enumerate(loads):
+        if i > 0:
+            # load cases are numbered in the order they are created
+            axmodel.LoadCases.Add('LC{}'.format(i+1), axtlb.lctStandard)
+        add_patch_load(axapp=axapp, axmodel=axmodel, load=load, 
+                       load_case=i+1)
+    
+    # add supports
+    NonLinearity = RNonLinearity(
+        x=lnlTensionAndCompression,
+        y=lnlTensionAndCompression,
+        z=lnlTensionAndCompression,
+        xx=lnlTensionAndCompression,
+        yy=lnlTensionAndCompression,
+        zz=lnlTensionAndCompression
+    )
+    Resistances = RResistances(
+        x=0, y=0, z=0,
+        xx=0, yy=0, zz=0
+    )
+    for i, edge in enumerate(['bottom', 'right', 'top', 'left']):
+        Stiffnesses = RStiffnesses(**support[edge])
+        axmodel.LineSupports.AddEdgeRelative(Stiffnesses, NonLinearity,
+                                             Resistances, i+1, 0, 0, 1, 0)
+
+
+def add_patch_load(*args, axapp, axmodel, load, load_case=1, **kwargs):
     # add path load
     # origo is located at the left bottom corner
     xc, yc, w, h, q = load['xc'], load['yc'], load['w'], load['h'], load['q']
@@ -95,7 +197,7 @@ def build(*args, axapp, axmodel, material, size,
     patchlines.Add(patchline3)
     patchlines.Add(patchline4)
     RectPatch = RLoadDomainPolyArea(
-        LoadCaseId=1,
+        LoadCaseId=load_case,
         DistributionType=dtGlobal,
         LoadDistributionType=ldtConst,
         Component=2,  # z direction
@@ -103,24 +205,15 @@ def build(*args, axapp, axmodel, material, size,
         WindowLoad=True
     )
     axmodel.Loads.AddDomainPolyArea(patchlines, RectPatch)
-    
-    # add supports
-    NonLinearity = RNonLinearity(
-        x=lnlTensionAndCompression,
-        y=lnlTensionAndCompression,
-        z=lnlTensionAndCompression,
-        xx=lnlTensionAndCompression,
-        yy=lnlTensionAndCompression,
-        zz=lnlTensionAndCompression
-    )
-    Resistances = RResistances(
-        x=0, y=0, z=0,
-        xx=0, yy=0, zz=0
-    )
-    for i, edge in enumerate(['bottom', 'right', 'top', 'left']):
-        Stiffnesses = RStiffnesses(**support[edge])
-        axmodel.LineSupports.AddEdgeRelative(Stiffnesses, NonLinearity,
-                                             Resistances, i+1, 0, 0, 1, 0)
+
+
+def is_alive(axapp):
+    # any COM call fails if the server is gone
+    try:
+        axapp.Visible
+    except Exception:
+        return False
+    return True
 
 
 def get_material_names(*args, axapp, **kwargs):
@@ -149,18 +242,20 @@ def generate_mesh(*args, axmodel, meshsize, **kwargs):
     def fnc(i): return axmodel.Surfaces.Item[i].GetContourPoints()[0]
     sIDs = axmodel.Domains[1].MeshSurfaceIds
     topo = np.vstack(list(map(fnc, sIDs))) - 1
-    
     return coords, topo
 
 
 def calculate(*args, axmodel, filename, **kwargs):
-    # calculate
-    axmodel.SaveToFile(filename, False)
-    axmodel.Calculation.LinearAnalysis(
-        axtlb.cuiNoUserInteractionWithAutoCorrectNoShow)
+    # the analysis requires a saved model, this is a scratch file of the
+    # worker, the models are kept by the `ModelStore` of the solver
+    with timed('save'):
+        axmodel.SaveToFile(filename, False)
+    with timed('analysis'):
+        axmodel.Calculation.LinearAnalysis(
+            axtlb.cuiNoUserInteractionWithAutoCorrectNoShow)
 
 
-def get_results(*args, axmodel, **kwargs):       
+def get_results(*args, axmodel, load_case=1, **kwargs):       
     # IDs of all the nodes in the model
     N = axmodel.Nodes.Count
     res2d = np.zeros((3, N))
@@ -168,7 +263,7 @@ def get_results(*args, axmodel, **kwargs):
     # get displacement results
     disps = axmodel.Results.Displacements
     disps.DisplacementSystem = dsGlobal
-    disps.LoadCaseId = 1
+    disps.LoadCaseId = load_case
     disps.LoadLevelOrModeShapeOrTimeStep = 1
     dres = disps.AllNodalDisplacementsByLoadCaseId()[0][:N]
     def fnc_ez(dres): return dres.ez
@@ -181,31 +276,99 @@ def get_results(*args, axmodel, **kwargs):
     return res2d
 
 
-def solver(in_queue, out_queue, material_names, visible=True):
+# fields of the internal forces of the surface records, in the order of
+# `forces` in src/backend/labels.py
+FORCE_FIELDS = ('mx', 'my', 'mxy', 'vxz', 'vyz')
+
+
+def get_element_results(*args, axmodel, load_case=1, **kwargs):
+    # internal forces at the corners of the surface elements, there is
+    # a record for every contour point of every surface, in the order of
+    # the surfaces, shape (5, nT, 3)
+    forces = axmodel.Results.Forces
+    forces.LoadCaseId = load_case
+    forces.LoadLevelOrModeShapeOrTimeStep = 1
+    fres = forces.AllSurfaceVertexForcesByLoadCaseId()[0]
+    values = np.array(list(map(attrgetter(*FORCE_FIELDS), fres)))
+    return values.reshape(-1, 3, len(FORCE_FIELDS)).transpose(2, 0, 1)
+
+
+def solve(params, *args, axapp, progress=None, **kwargs):
+    """
+    Solves a problem in a new model and returns the coordinates of the 
+    nodes, the topology of the triangles and the nodal results, the
+    displacements followed by the internal forces smoothed to the nodes,
+    see `components` in src/backend/labels.py. If there is a list of 
+    loads under 'loads' in the parameters, every load is solved in its 
+    own load case and the results are stacked into an array of shape 
+    (n_cases, nC, N).
+
+    If provided, `progress(stage, **info)` is called at the beginning of
+    the stages, see `serve`. The mesh is reported with the analysis.
+    """
+    if progress is None:
+        progress = no_progress
+    axapp.Models.New()  # cleans everything up
+    axmodel = axapp.Models[1]
+    progress(BUILDING)
+    with timed('build'), counted('build', axapp, axmodel) as (app, model):
+        build(axapp=app, axmodel=model, **params)
+    progress(MESHING)
+    with timed('mesh'), counted('mesh', axmodel) as (model,):
+        coords, topo = generate_mesh(axmodel=model, **params)
+    mesh_nodes.observe(len(coords))
+    mesh_elements.observe(len(topo))
+    progress(ANALYSING, nodes=len(coords), elements=len(topo), 
+             coords=coords, topo=topo)
+    calculate(axmodel=axmodel, **params)
+    progress(EXTRACTING)
+    n_cases = len(params.get('loads', None) or [None])
+    with timed('results'), counted('results', axmodel) as (model,):
+        disps = np.stack([get_results(axmodel=model, load_case=i+1) 
+                          for i in range(n_cases)])
+        eres = np.stack([get_element_results(axmodel=model, 
+                                             load_case=i+1)
+                         for i in range(n_cases)])
+    with timed('smoothing'):
+        forces = smooth(smoothing_operator(coords, topo), eres)
+    res2d = np.concatenate([disps, forces], axis=1)
+    if params.get('loads', None) is None:
+        res2d = res2d[0]
+    return coords, topo, res2d
+
+
+def solver(in_queue, out_queue, material_names, visible=True, max_batch=32,
+           persist=NEVER, directory='models', max_models=20):
+    """
+    Solves the problems put on `in_queue` as `(job_id, params)` tuples
+    and reports the state of the jobs on `out_queue`, until a `Sentinel`
+    is received. Queued problems of the same geometry are solved as the
+    load cases of a single model, at most `max_batch` at once.
+
+    The models are kept in a `ModelStore` in `directory` according to 
+    `persist`: 'never', 'on_demand' (problems with 'save' set in the
+    parameters, see `JobManager.save`) or 'write_behind' (every model,
+    after its results are reported).
+
+    AxisVM is checked before every problem and started again if it does
+    not respond.
+    """
     import comtypes
     comtypes.CoInitialize()
-    axapp = start_AxisVM(visible=visible, daemon=True)
-    material_names.extend(get_material_names(axapp=axapp))
-    while True:
-        # Get data
-        in_data = in_queue.get()
-        if isinstance(in_data, Sentinel):
-            in_queue.task_done()
-            break
-        print('New Problem!')
-        
-        # Process data
-        axapp.Models.New()  # cleans everything up
-        axmodel = axapp.Models[1]
-        build(axapp=axapp, axmodel=axmodel, **in_data)
-        coords, _ = generate_mesh(axmodel=axmodel, **in_data)
-        calculate(axmodel=axmodel, **in_data)
-        res2d = get_results(axmodel=axmodel)
-        
-        # Mark task as solved, optional
-        print('Problem Solved!')
-        in_queue.task_done()
-        
-        # Forward result to plotter
-        out_queue.put((in_data, coords, res2d))
-        print('Results Put!')
\ No newline at end of file
+    axapps = [start_AxisVM(visible=visible, daemon=True)]
+    material_names.extend(get_material_names(axapp=axapps[0]))
+    store = None
+    if persist != NEVER:
+        store = ModelStore(directory, max_models=max_models)
+    def save(params):
+        if store is not None and \
+                (persist == WRITE_BEHIND or params.get('save', False)):
+            with timed('persist'):
+                store.put(params, params['filename'])
+    def solve_(params, **kwargs):
+        if not is_alive(axapps[0]):
+            # the COM server died, the problem is solved by a new instance
+            solver_restarts.labels(reason='axisvm').inc()
+            axapps[0] = start_AxisVM(visible=visible, daemon=True)
+        return solve(params, axapp=axapps[0], **kwargs)
+    serve(in_queue, out_queue, solve_, max_batch=max_batch, after=save)
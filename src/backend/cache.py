@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict, defaultdict
+from copy import deepcopy
+from threading import RLock, Thread, Event
+import glob
+import hashlib
+import json
+import os
+import struct
+import zipfile
+import numpy as np
+
+
+__all__ = ['ResultCache', 'normalize_params', 'param_hash', 'result_key',
+           'compact']
+
+
+# the keys of the parameter dictionary that determine the solution
+PROBLEM_KEYS = ('material', 'size', 'thickness', 'load', 'loads', 'support',
+                'meshsize')
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, (bool, str)) or value is None:
+        return value
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    return str(value)
+
+
+def normalize_params(params):
+    """
+    Returns the part of a parameter dictionary that determines the
+    solution, in a canonical form (tuples are turned into lists,
+    numbers into floats). Everything else (like 'filename') is dropped.
+    """
+    return {key: _normalize(params[key]) for key in PROBLEM_KEYS
+            if key in params}
+
+
+# the version of the content of the results, entries of other versions
+# are not found, 2: internal forces after the displacements
+RESULTS_VERSION = 2
+
+
+def param_hash(params):
+    """
+    Returns a content address for a problem, as the SHA-256 hash of
+    the canonical JSON representation of the normalized parameters.
+    """
+    data = json.dumps([RESULTS_VERSION, normalize_params(params)],
+                      sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def result_key(params):
+    """
+    Returns the key a result is stored under. It is the hash of the
+    problem, except for the results solved in a batch with other patch
+    loads (with the loads of the model under 'batch', see `serve`), that
+    depend on the batch, since the mesh is fitted to all the patches.
+    """
+    key = param_hash(params)
+    if params.get('batch', None):
+        data = json.dumps(_normalize(params['batch']), sort_keys=True,
+                          separators=(',', ':'))
+        key += '-' + hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+    return key
+
+
+def compact(coords, topo, res2d, *args, dtype=None, **kwargs):
+    """
+    Returns the arrays of a result in a compact form. The z coordinates
+    are dropped if they are all zero (they are for the plate), the
+    topology is stored as 32-bit integers and the coordinates and the
+    results are converted to `dtype`, if it is provided.
+    """
+    coords, topo, res2d = map(np.asarray, (coords, topo, res2d))
+    if coords.shape[1] > 2 and not coords[:, 2:].any():
+        coords = coords[:, :2]
+    if len(coords) < 2**31:
+        topo = topo.astype(np.int32, copy=False)
+    if dtype is not None:
+        coords = coords.astype(dtype, copy=False)
+        res2d = res2d.astype(dtype, copy=False)
+    return tuple(map(np.ascontiguousarray, (coords, topo, res2d)))
+
+
+_read_array_header = {(1, 0): np.lib.format.read_array_header_1_0,
+                      (2, 0): np.lib.format.read_array_header_2_0}
+
+
+def _map_npz(path, names):
+    # maps the arrays of an uncompressed NPZ file into memory, the pages
+    # are shared by all the processes mapping the same file
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for name in names:
+            info = archive.getinfo(name + '.npy')
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('The file is compressed.')
+            # the local header of the member is followed by the array
+            f.seek(info.header_offset + 26)
+            n, m = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + n + m)
+            version = np.lib.format.read_magic(f)
+            if version not in _read_array_header:
+                raise ValueError('Unknown format {}.'.format(version))
+            shape, fortran, dtype = _read_array_header[version](f)
+            if dtype.hasobject or 0 in shape:
+                raise ValueError('The array can not be mapped.')
+            arrays[name] = np.asarray(np.memmap(
+                path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                order='F' if fortran else 'C'))
+    return arrays
+
+
+class ResultCache:
+    """
+    A content-addressed cache for solutions of the plate problem.
+
+    Entries are keyed by the hash of the normalized parameters and
+    hold the tuple `(params, coords, topo, res2d)`, with the arrays in a
+    compact form (see `compact`). The in-memory tier is an LRU with a
+    byte budget, the optional on-disk tier stores every entry as an NPZ
+    file and survives restarts.
+
+    If `mmap` is True, the entries of the in-memory tier are mapped from
+    the files of the on-disk tier instead of being read, so the processes
+    sharing the folder share one copy of every result. Put the folder on
+    a tmpfs (like /dev/shm) to keep it in memory.
+
+    Parameters
+    ----------
+    max_bytes : int, Optional
+        Byte budget of the in-memory tier. Default is 256 MB.
+
+    directory : str, Optional
+        Folder of the on-disk tier. If not provided, results are
+        only cached in memory. Default is None.
+
+    indexes : dict, Optional
+        Secondary indexes as a dictionary of names and functions, that
+        map parameters to hashable values. Entries with the same value
+        can be found with `lookup`. Default is None.
+
+    dtype : numpy.dtype, Optional
+        The floating point type the coordinates and the results are
+        stored with, like 'float32' for display. Default is None, which
+        keeps the type of the solution.
+
+    mmap : bool, Optional
+        If True, the entries are memory-mapped from the on-disk tier.
+        Default is False.
+
+    max_disk_bytes : int, Optional
+        Byte budget of the on-disk tier, shared by all the processes
+        using the folder. The least recently used files are removed.
+        Default is None, which means no limit.
+    """
+
+    def __init__(self, *args, max_bytes=256*2**20, directory=None,
+                 indexes=None, dtype=None, mmap=False, max_disk_bytes=None,
+                 **kwargs):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.indexes = {} if indexes is None else indexes
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.mmap = mmap and directory is not None
+        self.max_disk_bytes = max_disk_bytes
+        self.nbytes = 0
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._index = defaultdict(OrderedDict)
+        self._lock = RLock()
+        # the entries on disk are indexed in the background
+        self._scanned = Event()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        if directory is not None and self.indexes:
+            Thread(target=self._scan, daemon=True).start()
+        else:
+            self._scanned.set()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, params):
+        key = params if isinstance(params, str) else param_hash(params)
+        if key in self._data:
+            return True
+        return self._path(key) is not None and os.path.exists(self._path(key))
+
+    def _scan(self):
+        # indexes the entries on disk, only the parameters are read
+        # the newest first, entries put meanwhile are even more recent
+        try:
+            paths = glob.glob(os.path.join(self.directory, '*.npz'))
+            paths.sort(key=os.path.getmtime, reverse=True)
+            for path in paths:
+                key = os.path.splitext(os.path.basename(path))[0]
+                try:
+                    with np.load(path) as data:
+                        params = json.loads(str(data['params']))
+                except (OSError, ValueError, KeyError):
+                    continue
+                if key != param_hash(params):
+                    # derived entries (approximate results and the ones
+                    # of batches) are not indexed, like in `put`
+                    continue
+                with self._lock:
+                    self._register(key, params, recent=False)
+        finally:
+            self._scanned.set()
+
+    def _register(self, key, params, recent=True):
+        for name, fnc in self.indexes.items():
+            index = self._index[(name, fnc(params))]
+            if not recent:
+                if key not in index:
+                    index[key] = None
+                    index.move_to_end(key, last=False)
+                continue
+            index.pop(key, None)
+            index[key] = None
+
+    def lookup(self, name, params):
+        """
+        Returns the keys of the cached entries, that have the same value
+        as `params` in the secondary index `name`, the most recent first.
+        """
+        fnc = self.indexes[name]
+        self._scanned.wait()
+        with self._lock:
+            keys = list(self._index.get((name, fnc(params)), {}).keys())
+        return [key for key in reversed(keys) if key in self]
+
+    def _path(self, key):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, key + '.npz')
+
+    def _insert(self, key, entry):
+        _, coords, topo, res2d = entry
+        size = coords.nbytes + topo.nbytes + res2d.nbytes
+        if key in self._data:
+            self.nbytes -= self._data.pop(key)[0]
+        if size > self.max_bytes:
+            return
+        self._data[key] = (size, entry)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (size, _) = self._data.popitem(last=False)
+            self.nbytes -= size
+
+    def _load(self, key):
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        names = ('coords', 'topo', 'res2d')
+        try:
+            with np.load(path) as data:
+                params = json.loads(str(data['params']))
+                arrays = None
+                if self.mmap:
+                    try:
+                        arrays = _map_npz(path, names)
+                    except (ValueError, KeyError):
+                        pass
+                if arrays is None:
+                    arrays = {name: data[name] for name in names}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # a corrupted or incompatible file is just a miss
+            return None
+        self._touch(path)
+        arrays = compact(*(arrays[name] for name in names), dtype=self.dtype)
+        return (params,) + arrays
+
+    def _touch(self, path):
+        # the modification time orders the files for eviction
+        if self.max_disk_bytes is not None:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def _dump(self, key, entry):
+        params, coords, topo, res2d = entry
+        path = self._path(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, params=json.dumps(params),
+                     coords=coords, topo=topo, res2d=res2d)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # the file is mapped by another process (on Windows), it has
+            # the same content
+            os.remove(tmp)
+        self._prune(keep=path)
+
+    def _prune(self, keep=None):
+        # removes the least recently used files over the disk budget
+        if self.max_disk_bytes is None:
+            return
+        files = []
+        for path in glob.glob(os.path.join(self.directory, '*.npz')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort(reverse=True)
+        total = 0
+        for _, size, path in files:
+            total += size
+            if total <= self.max_disk_bytes or path == keep:
+                continue
+            try:
+                # mapped files are only gone when they are unmapped
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, params):
+        """
+        Returns the cached `(params, coords, topo, res2d)` tuple for a
+        problem or a key, or None if the problem is not cached.
+        """
+        key = params if isinstance(params, str) else param_hash(params)
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                entry = self._data[key][1]
+                if self.directory is not None:
+                    self._touch(self._path(key))
+            else:
+                entry = self._load(key)
+                if entry is None:
+                    self.misses += 1
+                    return None
+                self._insert(key, entry)
+            self.hits += 1
+        params, coords, topo, res2d = entry
+        return deepcopy(params), coords, topo, res2d
+
+    def put(self, params, coords, topo, res2d, key=None):
+        """
+        Stores a solution and returns its key. The key is `result_key`,
+        unless it is provided explicitly. Only the results stored under
+        the hash of the parameters are found by the parameters.
+        """
+        if key is None:
+            key = result_key(params)
+        entry = (deepcopy(params),) + compact(coords, topo, res2d, 
+                                               dtype=self.dtype)
+        exact = key == param_hash(params)
+        with self._lock:
+            if self.directory is not None and not \
+                    (key == result_key(params) and 
+                     os.path.exists(self._path(key))):
+                # solutions on disk under their content address are the
+                # same, like the ones stored by the processes of a
+                # `SolverDaemon`
+                self._dump(key, entry)
+            if self.mmap:
+                # the copy of the process is replaced by the mapped one
+                entry = self._load(key) or entry
+            self._insert(key, entry)
+            if exact:
+                # derived entries with custom keys are not indexed
+                self._register(key, params)
+        return key
+
+    def clear(self):
+        """
+        Empties the in-memory tier. The files on disk are kept.
+        """
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
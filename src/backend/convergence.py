@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Automatic choice of the mesh size.
+
+The problem is solved on a coarse mesh first, then on finer and finer
+meshes, until the maximum of |UZ| and the extrema of the rotations change
+by less than a tolerance between two steps. The coarser mesh of the two is
+the result, it is the coarsest mesh that meets the tolerance. The chosen
+mesh size is remembered with the history of the refinement for the
+configuration of the problem (everything but the mesh size and the
+intensity of the load, the solution is linear in it), so later solves of
+the configuration go straight to it.
+"""
+from copy import deepcopy
+from threading import RLock
+import json
+import os
+import numpy as np
+from .cache import param_hash
+from .labels import UZ, ROTX, ROTY
+
+
+__all__ = ['MeshConvergence', 'convergence_values', 'mesh_key']
+
+
+def convergence_values(res2d):
+    """
+    Returns the quantities checked for convergence as a dictionary:
+    the maximum of |UZ| and the minima and maxima of the rotations.
+    """
+    res2d = np.asarray(res2d)
+    uz, rx, ry = res2d[UZ], res2d[ROTX], res2d[ROTY]
+    return {'UZ': float(np.abs(uz).max()),
+            'ROTX_min': float(rx.min()), 'ROTX_max': float(rx.max()),
+            'ROTY_min': float(ry.min()), 'ROTY_max': float(ry.max())}
+
+
+def _change(values, previous):
+    # the largest change relative to the magnitude of the component, so
+    # extrema close to zero do not blow up the ratio
+    change = 0.
+    for key, value in values.items():
+        component = key.split('_')[0]
+        scale = max(abs(v) for k, v in values.items()
+                    if k.split('_')[0] == component)
+        if scale > 0:
+            change = max(change, abs(value - previous[key]) / scale)
+    return change
+
+
+def mesh_key(params):
+    """
+    Returns the key of the configuration of a problem, that is the hash
+    of the parameters without the mesh size and the load intensity.
+    """
+    params = deepcopy(params)
+    params.pop('meshsize', None)
+    for load in [params.get('load', None)] + params.get('loads', []):
+        if load is not None:
+            load.pop('q', None)
+    return param_hash(params)
+
+
+class MeshConvergence:
+    """
+    Finds and remembers the coarsest mesh size for which the results
+    converge, see the documentation of the module. The refinement is
+    driven by `JobManager.converge`.
+
+    Parameters
+    ----------
+    path : str, Optional
+        A JSON file the chosen mesh sizes are kept in between restarts.
+        Default is None.
+
+    tol : float, Optional
+        The largest relative change between two steps accepted. Default
+        is 0.01.
+
+    start : float, Optional
+        The mesh size of the first step. Default is None, which means a
+        quarter of the shorter side of the plate.
+
+    factor : float, Optional
+        The mesh size is multiplied with this at every step. Default is
+        0.7.
+
+    max_steps : int, Optional
+        The maximum number of steps. Default is 8.
+    """
+
+    def __init__(self, path=None, *args, tol=0.01, start=None, factor=0.7,
+                 max_steps=8, **kwargs):
+        self.path = path
+        self.tol = tol
+        self.start = start
+        self.factor = factor
+        self.max_steps = max_steps
+        self._meshsizes = {}
+        self._lock = RLock()
+        self._load()
+
+    def __contains__(self, params):
+        return self.get(params) is not None
+
+    def _load(self):
+        # the file is shared by the workers of the web server
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                meshsizes = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._meshsizes.update(meshsizes)
+
+    def meshsizes(self, params):
+        """
+        Returns the mesh sizes of the steps for the problem `params`.
+        """
+        if self.start is None:
+            meshsize = min(map(float, params['size'])) / 4
+        else:
+            meshsize = self.start
+        # rounded, so the steps are readable and their results shared
+        return [float('{:.3g}'.format(meshsize * self.factor**i))
+                for i in range(self.max_steps)]
+
+    def step(self, history, res2d, meshsize, nodes=None):
+        """
+        Appends the result of a step to the history and returns True if
+        the results converged, that is the change from the previous step
+        is below the tolerance.
+        """
+        values = convergence_values(res2d)
+        change = None if not history else \
+            _change(values, history[-1]['values'])
+        history.append({'meshsize': meshsize, 'nodes': nodes,
+                        'values': values, 'change': change})
+        return change is not None and change < self.tol
+
+    def _entry(self, params):
+        key = mesh_key(params)
+        if key not in self._meshsizes:
+            # it may have been found by another process
+            self._load()
+        entry = self._meshsizes.get(key, None)
+        if entry is not None and not isinstance(entry, dict):
+            # files of earlier versions only have the mesh sizes
+            entry = {'meshsize': entry, 'history': []}
+        return entry
+
+    def get(self, params):
+        """
+        Returns the chosen mesh size for the configuration of `params`,
+        or None if it is not known.
+        """
+        entry = self._entry(params)
+        return None if entry is None else entry['meshsize']
+
+    def history(self, params):
+        """
+        Returns the history of the refinement that chose the mesh size
+        for the configuration of `params` (see `step`), or None if it is
+        not known.
+        """
+        entry = self._entry(params)
+        return None if entry is None else entry['history']
+
+    def apply(self, params):
+        """
+        Returns `params` with the chosen mesh size of its configuration,
+        if it is known.
+        """
+        meshsize = self.get(params)
+        if meshsize is None:
+            return params
+        return dict(params, meshsize=meshsize)
+
+    def remember(self, params, meshsize, history=None):
+        """
+        Stores the chosen mesh size for the configuration of `params`,
+        with the history of the refinement.
+        """
+        with self._lock:
+            self._load()
+            self._meshsizes[mesh_key(params)] = {
+                'meshsize': meshsize, 'history': history or []}
+            if self.path is None:
+                return
+            tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(self._meshsizes, f)
+            os.replace(tmp, self.path)
@@ -0,0 +1,720 @@
+# -*- coding: utf-8 -*-
+"""
+A solver daemon shared by the processes of the web server.
+
+The daemon is a separate local process, that runs the solvers in worker
+processes and serves the processes of the web server (or any number of
+clients) through `multiprocessing.connection`. The workers store the
+results in a `ResultCache` on disk and only the keys of the results are
+sent to the clients, who map the files into memory, so the arrays are
+never pickled through a pipe (see `ResultCache` for where to put the
+folder).
+
+A watchdog thread of the daemon restarts the worker processes that died
+or that run a job for longer than the timeout. The jobs they were running
+fail, the ones they had not started yet are solved by the new process.
+
+Clients use `DaemonPool`, which has the interface of `SolverPool`, so it
+can be used with a `JobManager`:
+
+    >>> pool = DaemonPool(('localhost', 6001), material_names=names)
+    >>> jobs = JobManager(pool, cache=cache)
+
+The daemon is started with `daemon.py` in the root of the repository.
+"""
+from collections import deque
+from itertools import count
+from multiprocessing.connection import Listener, Client
+from queue import Queue, Empty
+from threading import Thread, Event, RLock, Condition
+import multiprocessing as mp
+import os
+import subprocess
+import tempfile
+import time
+from uuid import uuid4
+import numpy as np
+from prometheus_client import multiprocess
+from .cache import ResultCache, param_hash
+from .jobs import Sentinel, batch_key, QUEUED, RUNNING, DONE, FAILED, \
+    PROGRESS
+from .metrics import solver_restarts
+
+
+__all__ = ['SolverDaemon', 'DaemonPool', 'parse_address', 'get_authkey']
+
+
+# the file of the key of the connections, if it is not in the environment
+AUTHKEY_PATH = os.path.join(os.path.expanduser('~'), '.axisvm-dash-authkey')
+
+
+def get_authkey(path=AUTHKEY_PATH):
+    """
+    Returns the key of the connections to the daemon. It is read from
+    `AXISVM_DASH_AUTHKEY`, or from a file only readable by the user, that
+    is created with a random key if it does not exist. The messages are
+    unpickled, so the key must not be known to other users.
+    """
+    authkey = os.environ.get('AXISVM_DASH_AUTHKEY', None)
+    if authkey:
+        return authkey.encode()
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as f:
+            f.write(os.urandom(32).hex())
+    if os.name == 'posix' and os.stat(path).st_mode & 0o077:
+        raise PermissionError('{} is accessible by other users.'.format(path))
+    for _ in range(50):
+        with open(path, 'r') as f:
+            authkey = f.read().strip()
+        if authkey:
+            return authkey.encode()
+        # another process is writing it
+        time.sleep(.1)
+    raise RuntimeError('{} is empty.'.format(path))
+
+
+def parse_address(address):
+    """
+    Returns an address like 'localhost:6001' as a `(host, port)` tuple.
+    """
+    if isinstance(address, str):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return tuple(address)
+
+
+class _Names(list):
+    # the material names of a worker process, reported to the daemon
+
+    def __init__(self, out_queue):
+        super().__init__()
+        self.out_queue = out_queue
+
+    def extend(self, names):
+        super().extend(names)
+        self.out_queue.put((None, 'materials', list(names)))
+
+
+class _Outbox:
+    # the output queue of a worker process, the results are stored on
+    # disk and only their keys are sent, the mesh previews are written
+    # to files that are removed when the jobs showing them are finished
+
+    def __init__(self, out_queue, store):
+        self.out_queue = out_queue
+        self.store = store
+        # the mesh, the file and the ids of the jobs of the preview
+        self.preview = None
+
+    def put(self, out_data):
+        job_id, status, payload = out_data
+        if status == DONE:
+            payload = self.store.put(*payload)
+        elif status == PROGRESS and 'coords' in payload:
+            payload = dict(payload)
+            coords, topo = payload.pop('coords'), payload.pop('topo')
+            if self.preview is None or self.preview[0] is not coords:
+                # the jobs of a batch share the mesh
+                path = os.path.join(self.store.directory, 'previews',
+                                    uuid4().hex + '.npz')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                np.savez(path, coords=coords, topo=topo)
+                self._remove_preview()
+                self.preview = coords, path, set()
+            self.preview[2].add(job_id)
+            payload['preview'] = self.preview[1]
+        self.out_queue.put((job_id, status, payload))
+        if status in (DONE, FAILED) and self.preview is not None:
+            self.preview[2].discard(job_id)
+            if not self.preview[2]:
+                self._remove_preview()
+
+    def _remove_preview(self):
+        if self.preview is not None:
+            try:
+                os.remove(self.preview[1])
+            except OSError:
+                pass
+            self.preview = None
+
+
+def _work(target, in_queue, out_queue, directory, dtype, max_disk_bytes,
+          kwargs):
+    # the main function of a worker process, the stores of the clients
+    # do not write the results of the daemon, so the disk budget of the
+    # folder is kept by the workers
+    store = ResultCache(max_bytes=0, directory=directory, dtype=dtype,
+                        max_disk_bytes=max_disk_bytes)
+    target(in_queue, _Outbox(out_queue, store), _Names(out_queue), **kwargs)
+
+
+class _Worker:
+    # a worker process of the daemon with its queues
+
+    def __init__(self, index, filename):
+        self.index = index
+        self.filename = filename
+        self.process = None
+        self.restarts = 0
+        self.error = None
+        # the jobs sent to the process and the start of the running batch
+        self.assigned = []
+        self.started = None
+        # the last mesh preview written by the process
+        self.preview = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class SolverDaemon:
+    """
+    Runs solvers in worker processes and serves clients connecting to
+    `address`, see the documentation of the module.
+
+    Parameters
+    ----------
+    address : tuple or str
+        The address of the daemon, like ('localhost', 6001).
+
+    n_workers : int, Optional
+        The number of worker processes. Default is 1.
+
+    target : callable, Optional
+        The solver function run by the workers, see `SolverPool`. It is
+        pickled, so it must be a function of a module. Default is None,
+        which means `src.backend.backend.solver`.
+
+    cache_directory : str, Optional
+        The folder of the results, shared with the clients. Default is
+        '.cache'.
+
+    dtype : numpy.dtype, Optional
+        The floating point type of the stored results. Default is
+        'float32'.
+
+    max_disk_bytes : int, Optional
+        Byte budget of the folder of the results, see `ResultCache`.
+        Default is 2 GB.
+
+    timeout : float, Optional
+        The time in seconds a worker may spend on a job (or a batch of
+        jobs solved together), before it is restarted. Default is 300.
+
+    authkey : bytes, Optional
+        The key of the connections. Default is None, which means
+        `get_authkey()`.
+
+    filename : str, Optional
+        The scratch model files of the workers are named after this.
+        Default is 'DashModel.axs' in the folder of temporary files.
+
+    **kwargs : dict, Optional
+        Keyword arguments forwarded to `target`, like `max_batch` or the
+        `directory` of the kept models.
+    """
+
+    def __init__(self, address, *args, n_workers=1, target=None,
+                 cache_directory='.cache', dtype='float32',
+                 max_disk_bytes=2*2**30, timeout=300., authkey=None,
+                 filename=None, **kwargs):
+        if authkey is None:
+            authkey = get_authkey()
+        if target is None:
+            from .backend import solver as target
+        if filename is None:
+            filename = os.path.join(tempfile.gettempdir(), 'DashModel.axs')
+        self.address = parse_address(address)
+        self.target = target
+        self.directory = cache_directory
+        self.dtype = dtype
+        self.max_disk_bytes = max_disk_bytes
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.max_batch = kwargs.get('max_batch', 32)
+        self.material_names = []
+        os.makedirs(cache_directory, exist_ok=True)
+        name, ext = os.path.splitext(filename)
+        self.workers = [_Worker(i, '{}_{}{}'.format(name, i, ext))
+                        for i in range(n_workers)]
+        # the jobs by id as dictionaries, and the ones not sent to workers
+        self._jobs = {}
+        self._ids = count()
+        self._pending = deque()
+        self._lock = RLock()
+        self._changed = Condition(self._lock)
+        self._closed = Event()
+        # spawned processes do not inherit the COM state of the daemon
+        self._context = mp.get_context('spawn')
+        self.listener = Listener(self.address, authkey=authkey)
+
+    def serve_forever(self):
+        """
+        Starts the workers and serves the clients until `close` is called.
+        """
+        for worker in self.workers:
+            self._start(worker)
+        Thread(target=self._watch, daemon=True).start()
+        while not self._closed.is_set():
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                # the listener is closed or the client failed to connect
+                continue
+            Thread(target=self._handle, args=(_Channel(conn),),
+                   daemon=True).start()
+
+    def close(self):
+        """
+        Stops the workers and the serving of clients.
+        """
+        self._closed.set()
+        self.listener.close()
+        for worker in self.workers:
+            if worker.alive:
+                worker.in_queue.put(Sentinel())
+                worker.process.join(5)
+                if worker.alive:
+                    worker.process.terminate()
+
+    # the workers
+
+    def _start(self, worker):
+        worker.in_queue = self._context.JoinableQueue()
+        worker.out_queue = self._context.Queue()
+        worker.process = self._context.Process(
+            target=_work, args=(self.target, worker.in_queue,
+                                worker.out_queue, self.directory, self.dtype,
+                                self.max_disk_bytes, self.kwargs),
+            daemon=True)
+        worker.process.start()
+        worker.assigned, worker.started = [], None
+        Thread(target=self._read, args=(worker, worker.process),
+               daemon=True).start()
+
+    def _restart(self, worker, reason, error):
+        # the running jobs fail, the rest are solved by the new process
+        with self._lock:
+            worker.restarts += 1
+            worker.error = error
+            solver_restarts.labels(reason=reason).inc()
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.process.join(5)
+            if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+                # the live gauges of the process are not collected anymore
+                multiprocess.mark_process_dead(worker.process.pid)
+            if worker.preview is not None:
+                # the process could not remove it
+                try:
+                    os.remove(worker.preview)
+                except OSError:
+                    pass
+                worker.preview = None
+            assigned = worker.assigned
+            self._start(worker)
+            for job_id in reversed(assigned):
+                job = self._jobs.get(job_id, None)
+                if job is None:
+                    continue
+                if job['status'] == RUNNING:
+                    self._report(job_id, FAILED, error)
+                else:
+                    self._pending.appendleft(job_id)
+            self._dispatch()
+
+    def _watch(self):
+        # the watchdog of the workers
+        while not self._closed.wait(1.):
+            for worker in self.workers:
+                if not worker.alive:
+                    self._restart(worker, 'died', 'The solver process died.')
+                elif worker.started is not None and \
+                        time.time() - worker.started > self.timeout:
+                    self._restart(worker, 'timeout',
+                                  'The solver timed out after {:.0f} s.'
+                                  .format(self.timeout))
+
+    def _read(self, worker, process):
+        # forwards the messages of a worker process until it is replaced
+        while worker.process is process and not self._closed.is_set():
+            try:
+                job_id, status, payload = worker.out_queue.get(timeout=.5)
+            except Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                if worker.process is not process:
+                    break
+                if status == 'materials':
+                    if not self.material_names:
+                        self.material_names.extend(payload)
+                        self._changed.notify_all()
+                    continue
+                if status == RUNNING:
+                    worker.started = worker.started or time.time()
+                elif status == PROGRESS and 'preview' in payload:
+                    worker.preview = payload['preview']
+                elif status in (DONE, FAILED):
+                    if job_id in worker.assigned:
+                        worker.assigned.remove(job_id)
+                    if not worker.assigned:
+                        worker.started = None
+                self._report(job_id, status, payload)
+                if status in (DONE, FAILED):
+                    self._dispatch()
+
+    def _dispatch(self):
+        # sends the pending jobs to the idle workers, the ones of the same
+        # geometry together, so they are solved as the load cases of a model
+        with self._lock:
+            for worker in self.workers:
+                if not self._pending:
+                    return
+                if worker.assigned or not worker.alive:
+                    continue
+                first = self._pending.popleft()
+                batch = [first]
+                key = batch_key(self._jobs[first]['params'])
+                if key is not None:
+                    for job_id in list(self._pending):
+                        if len(batch) >= self.max_batch:
+                            break
+                        if batch_key(self._jobs[job_id]['params']) == key:
+                            self._pending.remove(job_id)
+                            batch.append(job_id)
+                for job_id in batch:
+                    params = dict(self._jobs[job_id]['params'],
+                                  filename=worker.filename)
+                    worker.in_queue.put((job_id, params))
+                worker.assigned = batch
+
+    def _report(self, job_id, status, payload):
+        # sends a message about a job to the clients waiting for it
+        job = self._jobs.get(job_id, None)
+        if job is None:
+            return
+        if status in (RUNNING, DONE, FAILED):
+            job['status'] = status
+        for channel, client_id in job['clients']:
+            channel.send(('job', client_id, status, payload))
+        if status in (DONE, FAILED):
+            del self._jobs[job_id]
+
+    def _find(self, channel, client_id):
+        # returns the id of the job a client waits for
+        for job_id, job in self._jobs.items():
+            if (channel, client_id) in job['clients']:
+                return job_id
+        return None
+
+    # the clients
+
+    def _handle(self, channel):
+        calls = {'hello': self.hello, 'materials': self.materials,
+                 'cancel': self.cancel, 'position': self.position,
+                 'health': self.health}
+        try:
+            while True:
+                message = channel.recv()
+                if message[0] == 'submit':
+                    self.submit(channel, *message[1:])
+                elif message[0] == 'call':
+                    _, call_id, name, args = message
+                    if name in ('cancel', 'position'):
+                        args = (channel,) + tuple(args)
+                    channel.send(('reply', call_id, calls[name](*args)))
+        except (EOFError, OSError):
+            pass
+        finally:
+            self._disconnect(channel)
+
+    def _disconnect(self, channel):
+        # the queued jobs nobody waits for are dropped
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                job['clients'] = [(c, i) for c, i in job['clients']
+                                  if c is not channel]
+                if not job['clients'] and job_id in self._pending:
+                    self._pending.remove(job_id)
+                    del self._jobs[job_id]
+
+    def submit(self, channel, client_id, params):
+        """
+        Queues a problem of a client. A problem identical to an unfinished
+        one shares its job.
+        """
+        key = param_hash(params), bool(params.get('save', False))
+        with self._lock:
+            for job in self._jobs.values():
+                if job['key'] == key:
+                    job['clients'].append((channel, client_id))
+                    if job['status'] == RUNNING:
+                        channel.send(('job', client_id, RUNNING, None))
+                    return
+            job_id = next(self._ids)
+            self._jobs[job_id] = {'clients': [(channel, client_id)],
+                                  'params': params, 'key': key,
+                                  'status': QUEUED}
+            self._pending.append(job_id)
+            self._dispatch()
+
+    def hello(self):
+        return {'workers': len(self.workers), 'directory': self.directory}
+
+    def materials(self, timeout=None):
+        """
+        Returns the names of the materials, when a worker has started.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.material_names, timeout)
+            return list(self.material_names)
+
+    def cancel(self, channel, client_id):
+        """
+        Stops a client from waiting for a job. The job is dropped, if it
+        has not been sent to a worker and nobody else waits for it.
+        """
+        with self._lock:
+            job_id = self._find(channel, client_id)
+            if job_id is None:
+                return False
+            job = self._jobs[job_id]
+            if len(job['clients']) > 1:
+                job['clients'].remove((channel, client_id))
+                return True
+            if job_id not in self._pending:
+                return False
+            self._pending.remove(job_id)
+            del self._jobs[job_id]
+            return True
+
+    def position(self, channel, client_id):
+        """
+        Returns the number of jobs ahead of a queued job of a client.
+        """
+        with self._lock:
+            job_id = self._find(channel, client_id)
+            if job_id not in self._pending:
+                return None
+            running = sum(len(worker.assigned) for worker in self.workers)
+            return running + self._pending.index(job_id)
+
+    def health(self):
+        """
+        Returns the state of the workers as a list of dictionaries.
+        """
+        with self._lock:
+            now = time.time()
+            return [{'worker': worker.index, 'alive': worker.alive,
+                     'pid': worker.process.pid, 'jobs': len(worker.assigned),
+                     'busy': None if worker.started is None else
+                     now - worker.started, 'restarts': worker.restarts,
+                     'error': worker.error} for worker in self.workers]
+
+
+class _Channel:
+    # a connection with a lock, it is written by several threads
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = RLock()
+
+    def send(self, message):
+        # returns False if the other end is gone
+        with self._lock:
+            try:
+                self.conn.send(message)
+            except (OSError, ValueError):
+                return False
+        return True
+
+    def recv(self):
+        return self.conn.recv()
+
+
+class DaemonPool:
+    """
+    A client of a `SolverDaemon` with the interface of `SolverPool`.
+
+    Parameters
+    ----------
+    address : tuple or str
+        The address of the daemon, like ('localhost', 6001).
+
+    authkey : bytes, Optional
+        The key of the connection. Default is None, which means
+        `get_authkey()`.
+
+    material_names : list, Optional
+        A list to be filled with the names of the materials in the
+        catalog. It blocks until a worker of the daemon has started.
+        Default is None.
+
+    cache : ResultCache, Optional
+        A cache on the folder of the results of the daemon. Default is
+        None, which means a memory-mapped one.
+
+    spawn : list, Optional
+        The command to start the daemon with, if it is not running.
+        Default is None.
+
+    timeout : float, Optional
+        The time to wait for a spawned daemon to accept connections.
+        Default is 60.
+    """
+
+    def __init__(self, address, *args, authkey=None, material_names=None,
+                 cache=None, spawn=None, timeout=60., **kwargs):
+        self.address = parse_address(address)
+        self.authkey = get_authkey() if authkey is None else authkey
+        self.spawn = spawn
+        self.timeout = timeout
+        self.out_queue = Queue()
+        self._ids = count()
+        self._calls = {}
+        self._submitted = set()
+        self._lock = RLock()
+        self._channel = None
+        self._connect()
+        info = self._call('hello')
+        self.n_workers = info['workers']
+        self.cache = cache if cache is not None else \
+            ResultCache(directory=info['directory'], mmap=True)
+        if material_names is not None:
+            material_names.extend(self._call('materials'))
+
+    def __len__(self):
+        return self.n_workers
+
+    def _connect(self):
+        with self._lock:
+            if self._channel is not None:
+                return
+            try:
+                conn = Client(self.address, authkey=self.authkey)
+            except OSError:
+                if self.spawn is None:
+                    raise
+                # another client may have started it meanwhile, the
+                # second daemon fails to listen and exits
+                subprocess.Popen(self.spawn)
+                deadline = time.time() + self.timeout
+                while True:
+                    time.sleep(.5)
+                    try:
+                        conn = Client(self.address, authkey=self.authkey)
+                        break
+                    except OSError:
+                        if time.time() > deadline:
+                            raise
+            self._channel = _Channel(conn)
+            Thread(target=self._read, args=(self._channel,),
+                   daemon=True).start()
+
+    def _read(self, channel):
+        try:
+            while True:
+                message = channel.recv()
+                if message[0] == 'reply':
+                    _, call_id, value = message
+                    event, _ = self._calls[call_id]
+                    self._calls[call_id] = event, value
+                    event.set()
+                    continue
+                _, job_id, status, payload = message
+                if status == DONE:
+                    result = self.cache.get(payload)
+                    if result is None:
+                        status, payload = FAILED, 'The result is missing.'
+                    else:
+                        payload = result
+                elif status == PROGRESS and 'preview' in payload:
+                    payload = dict(payload)
+                    try:
+                        with np.load(payload.pop('preview')) as data:
+                            payload['coords'] = data['coords']
+                            payload['topo'] = data['topo']
+                    except (OSError, ValueError, KeyError):
+                        # the solve is already over
+                        pass
+                if status in (DONE, FAILED):
+                    self._submitted.discard(job_id)
+                self.out_queue.put((job_id, status, payload))
+        except (EOFError, OSError):
+            pass
+        # the daemon is gone, the jobs fail and the next submission
+        # connects again
+        with self._lock:
+            if self._channel is channel:
+                self._channel = None
+            for job_id in list(self._submitted):
+                self.out_queue.put((job_id, FAILED,
+                                    'The connection to the solver is lost.'))
+            self._submitted.clear()
+            for call_id, (event, _) in list(self._calls.items()):
+                event.set()
+
+    def _send(self, message):
+        self._connect()
+        if not self._channel.send(message):
+            raise ConnectionError('The solver daemon is not reachable.')
+
+    def _call(self, name, *args, timeout=None):
+        call_id = next(self._ids)
+        event = Event()
+        self._calls[call_id] = event, None
+        try:
+            self._send(('call', call_id, name, args))
+        except ConnectionError:
+            self._calls.pop(call_id)
+            raise
+        event.wait(timeout)
+        return self._calls.pop(call_id)[1]
+
+    def put(self, in_data):
+        """
+        Sends a `(job_id, params)` tuple to the daemon.
+        """
+        job_id, params = in_data
+        self._submitted.add(job_id)
+        try:
+            self._send(('submit', job_id, params))
+        except OSError as e:
+            self._submitted.discard(job_id)
+            self.out_queue.put((job_id, FAILED, str(e)))
+
+    def release(self, job_id):
+        pass
+
+    def cancel(self, job_id):
+        """
+        Cancels a job, if the daemon has not sent it to a worker yet.
+        """
+        if self._call('cancel', job_id):
+            self._submitted.discard(job_id)
+            return True
+        return False
+
+    def position(self, job_id):
+        return self._call('position', job_id)
+
+    def health(self):
+        """
+        Returns the state of the workers of the daemon.
+        """
+        return self._call('health')
+
+    def close(self):
+        """
+        Closes the connection, the daemon keeps running.
+        """
+        with self._lock:
+            if self._channel is not None:
+                self._channel.conn.close()
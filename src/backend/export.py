@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Export of results as streams of bytes.
+
+The writers are generators, that yield the file in chunks of at most
+`chunk_size` nodes or triangles, so large meshes are never formatted in
+memory at once. The results are exported as they are in the cache (with
+float32 values for the app), the parameters of the problem are included
+as metadata where the format allows it.
+"""
+import io
+import json
+import zipfile
+import numpy as np
+from .cache import normalize_params
+
+
+__all__ = ['EXPORT_FORMATS', 'export_result']
+
+
+# the default number of rows (nodes or triangles) per chunk
+CHUNK_SIZE = 2**16
+
+
+def _chunks(array, chunk_size):
+    for i in range(0, len(array), chunk_size):
+        yield array[i:i + chunk_size]
+
+
+class _Buffer(io.RawIOBase):
+    # an unseekable stream, that is emptied by the generator of the file
+
+    def __init__(self):
+        self.data = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data.append(bytes(b))
+        return len(b)
+
+    def flush_data(self):
+        data, self.data = b''.join(self.data), []
+        return data
+
+
+def export_npz(params, coords, topo, res2d, *args, labels=None,
+               chunk_size=CHUNK_SIZE, **kwargs):
+    """
+    Yields an uncompressed NPZ file with the arrays 'coords', 'topo' and
+    'res2d', the parameters as JSON under 'params' and the labels of the
+    components under 'labels'. It is read by `numpy.load`.
+    """
+    arrays = {'params': np.array(json.dumps(normalize_params(params))),
+              'coords': coords, 'topo': topo, 'res2d': res2d}
+    if labels is not None:
+        arrays['labels'] = np.array(labels)
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name, array in arrays.items():
+            array = np.asarray(array, order='C')
+            with archive.open(name + '.npy', 'w',
+                              force_zip64=array.nbytes > 2**30) as f:
+                np.lib.format.write_array_header_1_0(
+                    f, np.lib.format.header_data_from_array_1_0(array))
+                for chunk in _chunks(array.reshape(-1), 8 * chunk_size):
+                    f.write(chunk.tobytes())
+                    yield buffer.flush_data()
+            yield buffer.flush_data()
+    yield buffer.flush_data()
+
+
+def export_vtk(params, coords, topo, res2d, *args, labels=None,
+               chunk_size=CHUNK_SIZE, **kwargs):
+    """
+    Yields a binary legacy VTK file of an unstructured grid of triangles,
+    with the components as point data, like for ParaView. The title of
+    the file is the problem as JSON, if it is short enough.
+    """
+    if labels is None:
+        labels = ['res{}'.format(i) for i in range(len(res2d))]
+    title = json.dumps(normalize_params(params), separators=(',', ':'))
+    if len(title) > 255:
+        title = 'AxisVM-Dash result'
+    N, nT = len(coords), len(topo)
+    yield '# vtk DataFile Version 3.0\n{}\nBINARY\n'.format(title).encode()
+    yield 'DATASET UNSTRUCTURED_GRID\nPOINTS {} float\n'.format(N).encode()
+    for chunk in _chunks(coords, chunk_size):
+        points = np.zeros((len(chunk), 3), dtype='>f4')
+        points[:, :chunk.shape[1]] = chunk[:, :3]
+        yield points.tobytes()
+    yield '\nCELLS {} {}\n'.format(nT, 4 * nT).encode()
+    for chunk in _chunks(topo, chunk_size):
+        cells = np.full((len(chunk), 4), 3, dtype='>i4')
+        cells[:, 1:] = chunk[:, :3]
+        yield cells.tobytes()
+    yield '\nCELL_TYPES {}\n'.format(nT).encode()
+    # 5 is VTK_TRIANGLE
+    for chunk in _chunks(np.arange(nT), chunk_size):
+        yield np.full(len(chunk), 5, dtype='>i4').tobytes()
+    yield '\nPOINT_DATA {}\n'.format(N).encode()
+    for label, values in zip(labels, res2d):
+        yield 'SCALARS {} float 1\nLOOKUP_TABLE default\n'.format(
+            label).encode()
+        for chunk in _chunks(values, chunk_size):
+            yield chunk.astype('>f4').tobytes()
+        yield b'\n'
+
+
+def export_csv(params, coords, topo, res2d, *args, labels=None,
+               chunk_size=CHUNK_SIZE, sig=8, **kwargs):
+    """
+    Yields a CSV file with the coordinates and the components at the
+    nodes, one node per row. The first line is a comment with the
+    parameters as JSON. The triangles are not exported.
+    """
+    if labels is None:
+        labels = ['res{}'.format(i) for i in range(len(res2d))]
+    yield '# {}\n'.format(json.dumps(normalize_params(params))).encode()
+    yield ','.join(['x', 'y'] + list(labels)).encode() + b'\n'
+    for i in range(0, len(coords), chunk_size):
+        rows = np.column_stack([coords[i:i + chunk_size, :2],
+                                res2d[:, i:i + chunk_size].T])
+        f = io.BytesIO()
+        np.savetxt(f, rows, fmt='%.{}g'.format(sig), delimiter=',')
+        yield f.getvalue()
+
+
+# file formats as the writer, the MIME type and the extension
+EXPORT_FORMATS = {
+    'npz': (export_npz, 'application/octet-stream', '.npz'),
+    'vtk': (export_vtk, 'application/octet-stream', '.vtk'),
+    'csv': (export_csv, 'text/csv', '.csv'),
+}
+
+
+def export_result(result, fmt, *args, **kwargs):
+    """
+    Returns a generator yielding a `(params, coords, topo, res2d)` result
+    as a file of the format `fmt` ('npz', 'vtk' or 'csv') in chunks of
+    bytes. The keyword arguments are forwarded to the writer, like the
+    `labels` of the components.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('Unknown format {}.'.format(fmt))
+    return EXPORT_FORMATS[fmt][0](*result, **kwargs)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+A pure NumPy finite element backend for the plate problem, as a drop-in
+replacement of the AxisVM pipeline in `src.backend.backend`. The functions
+`build`, `generate_mesh`, `calculate`, `get_results` and
+`get_element_results` have the same signatures and return the same data
+(the internal forces are constant over the elements here), with
+a `PlateModel` instance in the place of the AxisVM model.
+
+The plate is meshed with rectangular MITC4 (Mindlin-Reissner) elements,
+which are free of shear locking for thin plates. The mesh lines are fitted
+to the edges of the patch load, like in AxisVM. Each rectangle is split into
+two triangles for the topology returned by `generate_mesh`.
+"""
+from scipy.sparse import coo_matrix
+from scipy.sparse.linalg import splu
+import numpy as np
+from .jobs import serve, no_progress, BUILDING, MESHING, ANALYSING, \
+    EXTRACTING
+from .metrics import timed, mesh_nodes, mesh_elements
+from .materials import materials
+from .smoothing import smoothing_operator, smooth
+
+
+__all__ = ['PlateModel', 'build', 'generate_mesh', 'calculate',
+           'get_results', 'get_element_results', 'get_material_names',
+           'solve', 'solver', 'materials']
+
+
+# natural coordinates of the nodes of a rectangle and the Gauss points
+NODES = np.array([[-1., -1.], [1., -1.], [1., 1.], [-1., 1.]])
+GAUSS = NODES / np.sqrt(3.)
+
+
+class PlateModel:
+    """
+    The model of a rectangular plate, standing in for an AxisVM model.
+    """
+
+    def __init__(self):
+        self.E = self.nu = None
+        self.size = self.thickness = None
+        self.loads = []
+        self.support = None
+        self.coords = self.topo = self.quads = None
+        self.dofsol = None
+
+
+def shape_functions(xi, eta):
+    # bilinear shape functions and their derivatives wrt. xi and eta
+    N = (1 + xi*NODES[:, 0]) * (1 + eta*NODES[:, 1]) / 4
+    dN = np.array([NODES[:, 0] * (1 + eta*NODES[:, 1]),
+                   NODES[:, 1] * (1 + xi*NODES[:, 0])]) / 4
+    return N, dN
+
+
+def bending_matrix(ax, by, xi, eta):
+    # curvatures (kx, ky, kxy) of the elements, shape (nE, 3, 12)
+    # the nodal dofs are (UZ, ROTX, ROTY)
+    _, dN = shape_functions(xi, eta)
+    dNx = dN[0][None, :] / ax[:, None]
+    dNy = dN[1][None, :] / by[:, None]
+    B = np.zeros((len(ax), 3, 12))
+    B[:, 0, 2::3] = dNx
+    B[:, 1, 1::3] = -dNy
+    B[:, 2, 1::3] = -dNx
+    B[:, 2, 2::3] = dNy
+    return B
+
+
+def shear_matrix(ax, by, xi, eta):
+    # MITC4 assumed transverse shear strains (gxz, gyz), shape (nE, 2, 12)
+    # gxz is tied at (0, -1) and (0, 1), gyz at (-1, 0) and (1, 0)
+    def gxz(p):
+        N, dN = shape_functions(*p)
+        B = np.zeros((len(ax), 12))
+        B[:, 0::3] = dN[0][None, :] / ax[:, None]
+        B[:, 2::3] = N
+        return B
+    def gyz(p):
+        N, dN = shape_functions(*p)
+        B = np.zeros((len(ax), 12))
+        B[:, 0::3] = dN[1][None, :] / by[:, None]
+        B[:, 1::3] = -N
+        return B
+    B = np.zeros((len(ax), 2, 12))
+    B[:, 0, :] = (1 - eta) / 2 * gxz((0, -1)) + (1 + eta) / 2 * gxz((0, 1))
+    B[:, 1, :] = (1 - xi) / 2 * gyz((-1, 0)) + (1 + xi) / 2 * gyz((1, 0))
+    return B
+
+
+def material_matrices(E, nu, t):
+    Db = E * t**3 / (12 * (1 - nu**2)) * \
+        np.array([[1, nu, 0], [nu, 1, 0], [0, 0, (1 - nu) / 2]])
+    Ds = 5 / 6 * E / (2 * (1 + nu)) * t * np.eye(2)
+    return Db, Ds
+
+
+def element_stiffness(ax, by, E, nu, t):
+    # stiffness matrices of the elements, shape (nE, 12, 12)
+    Db, Ds = material_matrices(E, nu, t)
+    detJ = ax * by
+    K = np.zeros((len(ax), 12, 12))
+    for xi, eta in GAUSS:
+        Bb = bending_matrix(ax, by, xi, eta)
+        Bs = shear_matrix(ax, by, xi, eta)
+        K += Bb.transpose(0, 2, 1) @ Db @ Bb * detJ[:, None, None]
+        K += Bs.transpose(0, 2, 1) @ Ds @ Bs * detJ[:, None, None]
+    return K
+
+
+def get_material_names(*args, **kwargs):
+    return list(materials.keys())
+
+
+def build(*args, axmodel, material, size, thickness, support, load=None,
+          loads=None, **kwargs):
+    if material not in materials:
+        raise KeyError("Unknown material '{}'.".format(material))
+    axmodel.E, axmodel.nu = materials[material]
+    axmodel.size = tuple(map(float, size))
+    axmodel.thickness = float(thickness)
+    # every load is in its own load case
+    axmodel.loads = [dict(l) for l in ([load] if loads is None else loads)]
+    axmodel.support = support
+
+
+def grid_lines(L, cuts, meshsize):
+    # coordinates of the mesh lines, including the given cuts
+    breaks = np.unique(np.clip(np.r_[0., L, cuts], 0., L))
+    lines = [np.linspace(a, b, max(int(np.ceil((b - a) / meshsize)), 1) + 1)
+             for a, b in zip(breaks[:-1], breaks[1:]) if b - a > 1e-8 * L]
+    return np.unique(np.concatenate(lines))
+
+
+def generate_mesh(*args, axmodel, meshsize, **kwargs):
+    # fit the mesh to the edges of the patch loads
+    Lx, Ly = axmodel.size
+    xcuts = [[l['xc'] - l['w']/2, l['xc'] + l['w']/2] for l in axmodel.loads]
+    ycuts = [[l['yc'] - l['h']/2, l['yc'] + l['h']/2] for l in axmodel.loads]
+    x = grid_lines(Lx, np.ravel(xcuts), meshsize)
+    y = grid_lines(Ly, np.ravel(ycuts), meshsize)
+    nx, ny = len(x), len(y)
+
+    # coordinates of the nodes, numbered row by row
+    X, Y = np.meshgrid(x, y)
+    coords = np.zeros((nx * ny, 3))
+    coords[:, 0] = X.ravel()
+    coords[:, 1] = Y.ravel()
+
+    # counterclockwise rectangles and two triangles for each of them
+    n0 = (np.arange(ny - 1)[:, None] * nx + np.arange(nx - 1)[None, :]).ravel()
+    quads = np.stack([n0, n0 + 1, n0 + 1 + nx, n0 + nx], axis=1)
+    topo = np.vstack([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+
+    axmodel.coords, axmodel.quads, axmodel.topo = coords, quads, topo
+    return coords, topo
+
+
+def edge_springs(axmodel):
+    # stiffness of the line supports, as (rows, cols, data) of a sparse
+    # matrix, integrated with linear shape functions along the edges
+    coords, support = axmodel.coords, axmodel.support
+    Lx, Ly = axmodel.size
+    x, y = coords[:, 0], coords[:, 1]
+    tol = 1e-8 * max(Lx, Ly)
+    edges = {
+        'bottom': (np.abs(y) < tol, x, False),
+        'right': (np.abs(x - Lx) < tol, y, True),
+        'top': (np.abs(y - Ly) < tol, x, False),
+        'left': (np.abs(x) < tol, y, True),
+    }
+    rows, cols, data = [], [], []
+    k0 = np.array([[2., 1.], [1., 2.]]) / 6
+    for edge, (mask, s, along_y) in edges.items():
+        stiffness = support[edge]
+        # 'xx' is the rotation about the edge in the relative system
+        kxx, kyy = stiffness['xx'], stiffness['yy']
+        if along_y:
+            kxx, kyy = kyy, kxx
+        nodes = np.where(mask)[0]
+        nodes = nodes[np.argsort(s[nodes])]
+        segs = np.stack([nodes[:-1], nodes[1:]], axis=1)
+        lengths = np.diff(s[nodes])
+        for dof, k in enumerate([stiffness['z'], kxx, kyy]):
+            if k == 0:
+                continue
+            dofs = 3 * segs + dof
+            rows.append(np.repeat(dofs, 2, axis=1).ravel())
+            cols.append(np.tile(dofs, (1, 2)).ravel())
+            data.append((k * lengths[:, None, None] * k0).ravel())
+    return rows, cols, data
+
+
+def load_vectors(axmodel):
+    # consistent nodal loads of the patches, one column for each load
+    coords, quads = axmodel.coords, axmodel.quads
+    center = coords[quads, :2].mean(axis=1)
+    area = np.prod(coords[quads[:, 2], :2] - coords[quads[:, 0], :2], axis=1)
+    F = np.zeros((3 * len(coords), len(axmodel.loads)))
+    for i, l in enumerate(axmodel.loads):
+        inside = (np.abs(center[:, 0] - l['xc']) < l['w']/2) & \
+            (np.abs(center[:, 1] - l['yc']) < l['h']/2)
+        f = np.zeros(len(coords))
+        np.add.at(f, quads[inside].ravel(),
+                  np.repeat(l['q'] * area[inside] / 4, 4))
+        F[0::3, i] = f
+    return F
+
+
+def calculate(*args, axmodel, **kwargs):
+    coords, quads = axmodel.coords, axmodel.quads
+    size = 3 * len(coords)
+
+    # element stiffness matrices
+    half = (coords[quads[:, 2], :2] - coords[quads[:, 0], :2]) / 2
+    Ke = element_stiffness(half[:, 0], half[:, 1], axmodel.E, axmodel.nu,
+                           axmodel.thickness)
+    edofs = (3 * quads[:, :, None] + np.arange(3)[None, None, :])
+    edofs = edofs.reshape(len(quads), 12)
+    rows = [np.repeat(edofs, 12, axis=1).ravel()]
+    cols = [np.tile(edofs, (1, 12)).ravel()]
+    data = [Ke.ravel()]
+
+    # supports
+    srows, scols, sdata = edge_springs(axmodel)
+    rows, cols, data = rows + srows, cols + scols, data + sdata
+
+    # assemble and solve
+    K = coo_matrix((np.concatenate(data),
+                    (np.concatenate(rows), np.concatenate(cols))),
+                   shape=(size, size)).tocsc()
+    F = load_vectors(axmodel)
+    axmodel.dofsol = splu(K).solve(F)
+
+
+def get_results(*args, axmodel, load_case=1, **kwargs):
+    N = len(axmodel.coords)
+    return axmodel.dofsol[:, load_case-1].reshape(N, 3).T.copy()
+
+
+def get_element_results(*args, axmodel, load_case=1, **kwargs):
+    # internal forces (mx, my, mxy, vx, vy) at the centers of the
+    # rectangles, for both triangles of them, shape (5, nT)
+    coords, quads = axmodel.coords, axmodel.quads
+    u = axmodel.dofsol[:, load_case-1].reshape(len(coords), 3)
+    ue = u[quads].reshape(len(quads), 12, 1)
+    half = (coords[quads[:, 2], :2] - coords[quads[:, 0], :2]) / 2
+    Db, Ds = material_matrices(axmodel.E, axmodel.nu, axmodel.thickness)
+    # positive moments cause tension at the bottom face
+    m = -Db @ (bending_matrix(half[:, 0], half[:, 1], 0., 0.) @ ue)
+    v = Ds @ (shear_matrix(half[:, 0], half[:, 1], 0., 0.) @ ue)
+    res = np.concatenate([m[:, :, 0], v[:, :, 0]], axis=1).T
+    return np.tile(res, 2)
+
+
+def solve(params, *args, progress=None, **kwargs):
+    """
+    Solves a problem and returns the coordinates of the nodes,
+    the topology of the triangles and the nodal results, like
+    `src.backend.backend.solve`.
+    """
+    if progress is None:
+        progress = no_progress
+    axmodel = PlateModel()
+    progress(BUILDING)
+    with timed('build'):
+        build(axmodel=axmodel, **params)
+    progress(MESHING)
+    with timed('mesh'):
+        coords, topo = generate_mesh(axmodel=axmodel, **params)
+    mesh_nodes.observe(len(coords))
+    mesh_elements.observe(len(topo))
+    progress(ANALYSING, nodes=len(coords), elements=len(topo), 
+             coords=coords, topo=topo)
+    with timed('analysis'):
+        calculate(axmodel=axmodel, **params)
+    progress(EXTRACTING)
+    with timed('results'):
+        n_cases = len(params.get('loads', None) or [None])
+        disps = np.stack([get_results(axmodel=axmodel, load_case=i+1)
+                          for i in range(n_cases)])
+        eres = np.stack([get_element_results(axmodel=axmodel, load_case=i+1)
+                         for i in range(n_cases)])
+    with timed('smoothing'):
+        forces = smooth(smoothing_operator(coords, topo), eres)
+    res2d = np.concatenate([disps, forces], axis=1)
+    if params.get('loads', None) is None:
+        res2d = res2d[0]
+    return coords, topo, res2d
+
+
+def solver(in_queue, out_queue, material_names, *args, max_batch=32,
+           **kwargs):
+    """
+    The NumPy counterpart of `src.backend.backend.solver`. There are no
+    model files, so the persistence options are ignored.
+    """
+    material_names.extend(get_material_names())
+    serve(in_queue, out_queue, solve, max_batch=max_batch)
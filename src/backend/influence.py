@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Influence surfaces for instant updates of the position of the patch load.
+
+For a fixed plate, the plate is tiled with a grid of cells and the response
+to a unit load on every cell is solved once, in a single model with one load
+case per cell. The response to a patch load is then the superposition of the
+cell responses, weighted by the ratio of the area of the cells covered by
+the patch, which is exact for patches aligned with the cells. For other
+patches the load on the partially covered cells is smeared over the cells,
+and the error of this is estimated from the contributions of these cells.
+"""
+from copy import deepcopy
+import numpy as np
+from .cache import param_hash
+
+
+__all__ = ['InfluenceEngine']
+
+
+class InfluenceEngine:
+    """
+    Answers problems from precomputed influence surfaces.
+
+    The unit responses are solved as ordinary jobs, with the loads of the
+    cells under 'loads' in the parameters, so they are kept in the result
+    cache like any other result and are shared by all the users of it.
+
+    Parameters
+    ----------
+    cache : ResultCache
+        The cache the unit responses are looked up in.
+
+    shape : tuple, Optional
+        The number of cells in the x and y directions. Default is (16, 12).
+
+    tol : float, Optional
+        Results with an estimated relative error above this are rejected.
+        Default is 0.05.
+    """
+
+    def __init__(self, cache, *args, shape=(16, 12), tol=0.05, **kwargs):
+        self.cache = cache
+        self.shape = shape
+        self.tol = tol
+
+    def edges(self, params):
+        Lx, Ly = map(float, params['size'])
+        nx, ny = self.shape
+        return np.linspace(0., Lx, nx + 1), np.linspace(0., Ly, ny + 1)
+
+    def basis_params(self, params):
+        """
+        Returns the parameters of the problem of the unit responses for
+        the plate of `params`.
+        """
+        x, y = self.edges(params)
+        xc, yc = (x[1:] + x[:-1]) / 2, (y[1:] + y[:-1]) / 2
+        w, h = x[1] - x[0], y[1] - y[0]
+        res = deepcopy(params)
+        res.pop('load', None)
+        res['loads'] = [{'xc': float(xc[i]), 'yc': float(yc[j]),
+                         'w': float(w), 'h': float(h), 'q': 1.}
+                        for j in range(len(yc)) for i in range(len(xc))]
+        return res
+
+    def overlaps(self, params):
+        """
+        Returns the ratios of the cells covered by the patch of `params`
+        and the offsets of the centers of the covered parts from the
+        centers of the cells, relative to the size of the cells, in the
+        x and y directions.
+        """
+        x, y = self.edges(params)
+        load = params['load']
+        def overlap(edges, c, d):
+            lo = np.maximum(edges[:-1], c - d/2)
+            hi = np.minimum(edges[1:], c + d/2)
+            size = np.diff(edges)
+            ratio = np.clip(hi - lo, 0, None) / size
+            offset = np.where(ratio > 0, (lo + hi - edges[:-1] - edges[1:])
+                              / 2 / size, 0.)
+            return ratio, offset
+        wx, ox = overlap(x, float(load['xc']), float(load['w']))
+        wy, oy = overlap(y, float(load['yc']), float(load['h']))
+        return wx, wy, ox, oy
+
+    def weights(self, params):
+        """
+        Returns the ratio of the area of every cell covered by the patch
+        of `params`, in the order of the load cases of `basis_params`.
+        """
+        wx, wy, _, _ = self.overlaps(params)
+        return np.outer(wy, wx).ravel()
+
+    def query(self, params):
+        """
+        Returns the `(params, coords, topo, res2d)` result of a problem
+        and the estimated relative error of it, or None if the unit
+        responses of the plate are not available.
+        """
+        basis = self.cache.get(self.basis_params(params))
+        if basis is None:
+            return None
+        _, coords, topo, R = basis
+        q = float(params['load']['q'])
+        wx, wy, ox, oy = self.overlaps(params)
+        res2d = q * np.tensordot(np.outer(wy, wx).ravel(), R, axes=(0, 0))
+        # the load of a partially covered cell is smeared over the cell,
+        # the error is estimated as the first order term of the shift of
+        # the load from the center of the covered part to that of the cell
+        R = R.reshape(len(wy), len(wx), *R.shape[1:])
+        shift = np.zeros_like(res2d)
+        for i in np.nonzero(ox)[0]:
+            lo, hi = max(i - 1, 0), min(i + 1, len(wx) - 1)
+            if hi > lo:
+                dR = (R[:, hi] - R[:, lo]) / (hi - lo)
+                shift += wx[i] * ox[i] * np.tensordot(wy, dR, axes=(0, 0))
+        for j in np.nonzero(oy)[0]:
+            lo, hi = max(j - 1, 0), min(j + 1, len(wy) - 1)
+            if hi > lo:
+                dR = (R[hi] - R[lo]) / (hi - lo)
+                shift += wy[j] * oy[j] * np.tensordot(wx, dR, axes=(0, 0))
+        scale = np.abs(res2d).max(axis=1)
+        scale[scale == 0] = 1.
+        error = float((np.abs(q * shift).max(axis=1) / scale).max())
+        return (params, coords, topo, res2d), error
+
+    def available(self, params):
+        return self.basis_params(params) in self.cache
+
+    def applies(self, params):
+        # a single patch load, at least partially on the plate
+        return 'load' in params and 'loads' not in params and \
+            self.weights(params).sum() > 0
+
+    def solve(self, params):
+        """
+        Returns a result and a dictionary describing its derivation, or
+        None if the problem can not be answered with the required accuracy.
+        """
+        if not self.applies(params):
+            return None
+        res = self.query(params)
+        if res is None or res[1] > self.tol:
+            return None
+        result, error = res
+        info = {'source': param_hash(self.basis_params(params)),
+                'error': error, 'approximate': True, 'influence': True}
+        return result, info
@@ -0,0 +1,565 @@
+# -*- coding: utf-8 -*-
+from threading import Thread, Event, RLock, Condition
+from collections import OrderedDict, deque
+from queue import Empty
+from uuid import uuid4
+import json
+import time
+from .cache import normalize_params, param_hash, result_key
+from .scaling import scale_from_cache
+from .metrics import queue_wait_seconds, stage_seconds, batch_cases, \
+    cache_requests, cancelled_jobs
+
+
+__all__ = ['Job', 'JobManager', 'Sentinel', 'serve', 'batch_key', 'QUEUED',
+           'RUNNING', 'DONE', 'FAILED', 'CANCELLED', 'PROGRESS', 'STAGES',
+           'BUILDING', 'MESHING', 'ANALYSING', 'EXTRACTING', 'CONVERGING']
+
+
+# states of a job
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+CANCELLED = 'cancelled'
+# reports of the stages of a running job
+PROGRESS = 'progress'
+# the stages of a solve, in order
+STAGES = BUILDING, MESHING, ANALYSING, EXTRACTING = \
+    'building', 'meshing', 'analysing', 'extracting'
+# the refinement of the mesh by `JobManager.converge`
+CONVERGING = 'converging'
+
+
+class Sentinel: ...
+
+
+def no_progress(stage, **info):
+    # the progress of solves outside of `serve` is not reported
+    pass
+
+
+def batch_key(params):
+    """
+    Returns a string that is the same for problems that only differ in
+    the patch load, or None if the problem can not be batched.
+    """
+    if 'load' not in params or 'loads' in params:
+        return None
+    if params.get('save', False):
+        # the model is saved under the parameters of the problem
+        return None
+    params = normalize_params(params)
+    params.pop('load')
+    return json.dumps(params, sort_keys=True)
+
+
+def serve(in_queue, out_queue, solve, *args, max_batch=32, after=None,
+          **kwargs):
+    """
+    Runs the solver side of the job protocol until a `Sentinel` is
+    received. Problems are read from `in_queue` as `(job_id, params)`
+    tuples and `solve(params)` is expected to return `(coords, topo, res2d)`.
+    The state of the jobs is reported on `out_queue`.
+
+    `solve` is also called with a `progress` keyword argument, a function
+    to be called as `progress(stage, **info)` at the beginning of the
+    stages in `STAGES`, that is reported as a 'progress' message with
+    `dict(info, stage=stage)` as the payload for every job of the batch.
+
+    Queued problems that only differ in the patch load are solved together
+    as the load cases of a single model, with the loads under 'loads' in
+    the parameters, so the model is built, meshed and factorized once.
+    At most `max_batch` problems are solved together. The mesh is fitted
+    to the edges of all the patches, so it is finer than the one of a
+    single problem and the results depend on the batch. They are reported
+    with the loads of the model under 'batch' in the parameters, and are
+    stored under their own keys, see `result_key`.
+
+    If provided, `after(params)` is called with the parameters of every
+    solved model, after the results are reported, like for saving the
+    model without delaying the results.
+    """
+    backlog = deque()
+    while True:
+        # Get data
+        in_data = backlog.popleft() if backlog else in_queue.get()
+        if isinstance(in_data, Sentinel):
+            in_queue.task_done()
+            break
+        batch = [in_data]
+        key = batch_key(in_data[1])
+        if key is not None and hasattr(in_queue, 'mutex'):
+            # take the queued problems of the same geometry, the others
+            # stay in the queue, where they can be found and cancelled
+            with in_queue.mutex:
+                for queued in list(in_queue.queue):
+                    if len(batch) >= max_batch or \
+                            isinstance(queued, Sentinel):
+                        break
+                    if batch_key(queued[1]) == key:
+                        in_queue.queue.remove(queued)
+                        batch.append(queued)
+        elif key is not None:
+            # the queues of processes can not be searched
+            while len(batch) < max_batch:
+                try:
+                    queued = in_queue.get_nowait()
+                except Empty:
+                    break
+                if not isinstance(queued, Sentinel) and \
+                        batch_key(queued[1]) == key:
+                    batch.append(queued)
+                else:
+                    backlog.append(queued)
+        batch_cases.observe(len(batch))
+        for job_id, _ in batch:
+            out_queue.put((job_id, RUNNING, None))
+        def progress(stage, **info):
+            for job_id, _ in batch:
+                out_queue.put((job_id, PROGRESS, dict(info, stage=stage)))
+        
+        # Process data
+        solved = in_data[1]
+        try:
+            if len(batch) == 1:
+                coords, topo, res2d = solve(solved, progress=progress)
+                results = [res2d]
+            else:
+                solved = dict(solved)
+                del solved['load']
+                solved['loads'] = [p['load'] for _, p in batch]
+                coords, topo, results = solve(solved, progress=progress)
+        except Exception as e:
+            for job_id, _ in batch:
+                out_queue.put((job_id, FAILED, repr(e)))
+        else:
+            # Forward result to the job manager
+            for (job_id, params), res2d in zip(batch, results):
+                if len(batch) > 1:
+                    params = dict(params, batch=solved['loads'])
+                out_queue.put((job_id, DONE, (params, coords, topo, res2d)))
+            if after is not None:
+                try:
+                    after(solved)
+                except Exception:
+                    # the results are already reported
+                    pass
+        finally:
+            for _ in batch:
+                in_queue.task_done()
+
+
+class Job:
+    """
+    A calculation submitted to the solver. The state moves from
+    'queued' through 'running' to either 'done' or 'failed'. Queued
+    jobs may also be 'cancelled'.
+    """
+
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.key = param_hash(params)
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        # how the result was derived from a cached one, if it was
+        self.info = None
+        self.submitted = time.time()
+        self.started = self.finished = None
+        # the number of submissions waiting for the job
+        self.waiters = 1
+        # the last reported stage of the solve with its details (like the
+        # size of the mesh) and the mesh as `(coords, topo)`, if it is ready
+        self.progress = {}
+        self.preview = None
+        # incremented at every change of the state
+        self.version = 0
+        self._event = Event()
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the job is finished or the timeout expires and
+        returns True if the job is finished.
+        """
+        return self._event.wait(timeout)
+
+    def to_dict(self):
+        return {'id': self.id, 'key': self.key, 'status': self.status,
+                'error': self.error, 'info': self.info,
+                'submitted': self.submitted, 'progress': self.progress,
+                'version': self.version}
+
+
+class JobManager:
+    """
+    Non-blocking interface to a pool of solvers.
+
+    Problems are dispatched to the pool as `(job_id, params)` tuples and
+    the solvers report back through the `out_queue` of the pool with
+    `(job_id, status, payload)` tuples, where the payload is
+    `(params, coords, topo, res2d)` for finished jobs and an error message
+    for failed ones. A background thread collects these messages and
+    updates the jobs.
+
+    Parameters
+    ----------
+    pool : SolverPool
+        The solvers.
+
+    cache : ResultCache, Optional
+        If provided, cached solutions are returned without a solve
+        and new solutions are added to it. If the cache has the indexes
+        in `scaling_indexes`, problems that differ from a cached one only
+        in the intensity of the load are solved by scaling, see
+        `src.backend.scaling`. Default is None.
+
+    influence : InfluenceEngine, Optional
+        If provided, approximate results may also be superposed from the
+        influence surfaces of the plate, see `src.backend.influence`.
+        Default is None.
+
+    meshes : MeshConvergence, Optional
+        If provided, problems can be solved on an automatically chosen
+        mesh with `converge`, see `src.backend.convergence`. Default is
+        None.
+
+    max_jobs : int, Optional
+        Finished jobs above this number are forgotten, oldest first.
+        Default is 1000.
+
+    Notes
+    -----
+    Problems that are identical to one being solved share its job
+    instead of being solved again.
+    """
+
+    def __init__(self, pool, *args, cache=None, influence=None,
+                 meshes=None, max_jobs=1000, **kwargs):
+        self.pool = pool
+        self.cache = cache
+        self.influence = influence
+        self.meshes = meshes
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        # the unfinished jobs sent to the solvers, see `_inflight_key`
+        self._inflight = {}
+        self._lock = RLock()
+        self._changed = Condition(self._lock)
+        self._collector = Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def __getitem__(self, job_id):
+        return self._jobs[job_id]
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def get(self, job_id):
+        return self._jobs.get(job_id, None)
+
+    def submit(self, params, *args, use_cache=True, approximate=False,
+               supersedes=None, **kwargs):
+        """
+        Submits a problem and returns the id of the job immediately.
+        If `approximate` is True, the result may be derived from a cached
+        one by an approximate scaling rule. Such results have their own
+        keys in the cache and are flagged in `Job.info`.
+
+        If an identical problem is being solved, the id of its job is
+        returned. `supersedes` is the id of an earlier job of the same
+        client, that is cancelled if it is still queued and no other
+        submission is waiting for it.
+        """
+        job = Job(uuid4().hex, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        result = None
+        if use_cache and self.cache is not None:
+            result = self.cache.get(params)
+            if result is None:
+                scaled = scale_from_cache(self.cache, params, 
+                                          approximate=approximate)
+                if scaled is None and approximate and \
+                        self.influence is not None:
+                    scaled = self.influence.solve(params)
+                if scaled is not None:
+                    result, job.info = scaled
+                    if job.info['approximate']:
+                        job.key += '-approx'
+                    result = self._store(result, key=job.key)
+                    outcome = 'influence' if job.info.get('influence') \
+                        else 'scaled'
+                else:
+                    outcome = 'miss'
+            else:
+                outcome = 'hit'
+            cache_requests.labels(outcome=outcome).inc()
+        if result is not None:
+            self._finish(job, DONE, result)
+        else:
+            with self._lock:
+                leader = self._inflight.get(self._inflight_key(job), None)
+                if leader is not None:
+                    # wait for the same solve
+                    del self._jobs[job.id]
+                    leader.waiters += 1
+                    job = leader
+                else:
+                    self._inflight[self._inflight_key(job)] = job
+            if leader is not None:
+                if use_cache and self.cache is not None:
+                    cache_requests.labels(outcome='coalesced').inc()
+            else:
+                self.pool.put((job.id, params))
+        if supersedes is not None and supersedes != job.id:
+            self.cancel(supersedes)
+        return job.id
+
+    def cancel(self, job_id):
+        """
+        Withdraws a submission of a job. The job is cancelled, if no
+        other submission is waiting for it and no solver has picked it up
+        yet. Returns True if the job is cancelled.
+        """
+        with self._lock:
+            job = self.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.waiters -= 1
+            if job.waiters > 0 or not self.pool.cancel(job.id):
+                return False
+            self._finish(job, CANCELLED, 'Superseded by a newer job.')
+        cancelled_jobs.inc()
+        return True
+
+    def precompute(self, params):
+        """
+        Submits the calculation of the influence surfaces of the plate
+        of `params` and returns the id of the job.
+        """
+        if self.influence is None:
+            raise RuntimeError('The manager has no influence engine.')
+        return self.submit(self.influence.basis_params(params))
+
+    def save(self, params):
+        """
+        Submits a solve of a problem, that also saves the model if the
+        solvers have a model store, and returns the id of the job.
+        """
+        return self.submit(dict(params, save=True), use_cache=False)
+
+    def converge(self, params, *args, approximate=False, **kwargs):
+        """
+        Solves a problem on the coarsest mesh the results converge on and
+        returns the id of the job. If the mesh size of the configuration
+        is known, the problem is submitted with it, otherwise the job
+        refines the mesh with solves of its own, reported as the steps of
+        the 'converging' stage. The `info` of the job has the chosen
+        'meshsize', whether the results 'converged' and the 'history' of
+        the refinement, and 'remembered' if the mesh size was known.
+        """
+        if self.meshes is None:
+            raise RuntimeError('The manager has no mesh convergence.')
+        meshsize = self.meshes.get(params)
+        if meshsize is not None:
+            job = self.get(self.submit(dict(params, meshsize=meshsize),
+                                       approximate=approximate))
+            with self._lock:
+                # approximate results keep their own info
+                if job.info is None or not job.info['approximate']:
+                    job.info = dict(job.info or {}, approximate=False,
+                                    converged=True, meshsize=meshsize,
+                                    remembered=True,
+                                    history=self.meshes.history(params))
+            return job.id
+        job = Job(uuid4().hex, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        Thread(target=self._converge, args=(job,), daemon=True).start()
+        return job.id
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        return None if job is None else job.status
+
+    def result(self, job_id, timeout=None):
+        """
+        Waits for a job and returns its `(params, coords, topo, res2d)`
+        result.
+        """
+        job = self._jobs[job_id]
+        if not job.wait(timeout):
+            raise TimeoutError('Job {} is not finished.'.format(job_id))
+        if job.status in (FAILED, CANCELLED):
+            raise RuntimeError(job.error)
+        return job.result
+
+    def watch(self, job_id, version=-1, timeout=None):
+        """
+        Waits until the `version` of a job differs from the given one
+        (which is immediately for the default) or the timeout expires,
+        and returns the job, or None if the job is unknown.
+        """
+        with self._changed:
+            job = self.get(job_id)
+            if job is not None:
+                self._changed.wait_for(lambda: job.version != version,
+                                       timeout)
+        return job
+
+    def position(self, job_id):
+        """
+        Returns the number of jobs ahead of a queued job, or None if the
+        job is not queued.
+        """
+        job = self.get(job_id)
+        if job is None or job.status != QUEUED:
+            return None
+        return self.pool.position(job_id)
+
+    def as_completed(self, jobs, timeout=None):
+        """
+        Yields the given jobs (instances of `Job`) in the order they
+        finish. The timeout applies to the waiting for each job.
+        """
+        pending = list(jobs)
+        while pending:
+            with self._changed:
+                finished = [job for job in pending if job.done]
+                if not finished:
+                    if not self._changed.wait(timeout):
+                        raise TimeoutError('No job finished in time.')
+                    continue
+            for job in finished:
+                pending.remove(job)
+                yield job
+
+    def close(self):
+        """
+        Stops the collector thread. The solvers are not stopped.
+        """
+        self.pool.out_queue.put(Sentinel())
+        self._collector.join()
+
+    def _prune(self):
+        finished = [j.id for j in self._jobs.values() if j.done]
+        for job_id in finished[:max(len(self._jobs) - self.max_jobs, 0)]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _inflight_key(job):
+        # saving the model makes a difference for the solver
+        return job.key, bool(job.params.get('save', False))
+
+    def _store(self, result, key=None):
+        # finished jobs hold the compact (and maybe mapped) copy of the
+        # cache instead of the solution
+        key = self.cache.put(*result, key=key)
+        return self.cache.get(key) or result
+
+    def _finish(self, job, status, payload, key=None):
+        with self._changed:
+            if self._inflight.get(self._inflight_key(job), None) is job:
+                del self._inflight[self._inflight_key(job)]
+            if key is not None:
+                job.key = key
+            job.finished = time.time()
+            if status == DONE:
+                job.result = payload
+            else:
+                job.error = payload
+            job.status = status
+            job.version += 1
+            job._event.set()
+            self._changed.notify_all()
+
+    def _converge(self, job):
+        # refines the mesh until the change of the results is small enough,
+        # the steps are ordinary jobs, so they are cached and coalesced
+        meshsizes = self.meshes.meshsizes(job.params)
+        history, steps = [], []
+        with self._changed:
+            job.started = time.time()
+            job.status = RUNNING
+            job.version += 1
+            self._changed.notify_all()
+        for i, meshsize in enumerate(meshsizes):
+            with self._changed:
+                job.progress = dict(job.progress, stage=CONVERGING, 
+                                    step=i + 1, steps=len(meshsizes),
+                                    meshsize=meshsize)
+                job.version += 1
+                self._changed.notify_all()
+            step = self.get(self.submit(dict(job.params, meshsize=meshsize)))
+            try:
+                _, coords, topo, res2d = self.result(step.id)
+            except RuntimeError as e:
+                self._finish(job, FAILED, str(e))
+                return
+            steps.append(step)
+            converged = self.meshes.step(history, res2d, meshsize, 
+                                         nodes=len(coords))
+            with self._changed:
+                # the mesh of the last step is the preview
+                job.preview = coords, topo
+                job.progress = dict(job.progress, nodes=len(coords), 
+                                    change=history[-1]['change'])
+                job.version += 1
+                self._changed.notify_all()
+            if converged:
+                break
+        # the coarser mesh of the last two meets the tolerance
+        chosen = steps[-2] if converged else steps[-1]
+        if converged:
+            self.meshes.remember(job.params, chosen.params['meshsize'],
+                                 history)
+        job.key = chosen.key
+        job.info = {'approximate': False, 'converged': converged,
+                    'meshsize': chosen.params['meshsize'], 
+                    'history': history}
+        self._finish(job, DONE, chosen.result)
+
+    def _collect(self):
+        while True:
+            out_data = self.pool.out_queue.get()
+            if isinstance(out_data, Sentinel):
+                break
+            job_id, status, payload = out_data
+            if status in (DONE, FAILED):
+                self.pool.release(job_id)
+            job = self.get(job_id)
+            if job is None:
+                continue
+            if status == RUNNING:
+                with self._changed:
+                    job.started = time.time()
+                    job.status = RUNNING
+                    job.version += 1
+                    self._changed.notify_all()
+                queue_wait_seconds.observe(job.started - job.submitted)
+                continue
+            if status == PROGRESS:
+                with self._changed:
+                    info = dict(payload)
+                    if 'coords' in info:
+                        job.preview = info.pop('coords'), info.pop('topo')
+                    # the details of earlier stages are kept
+                    job.progress = dict(job.progress, **info)
+                    job.version += 1
+                    self._changed.notify_all()
+                continue
+            key = None
+            if status == DONE:
+                # the results of batches have keys of their own
+                key = result_key(payload[0])
+                if self.cache is not None:
+                    payload = self._store(payload, key=key)
+            self._finish(job, status, payload, key=key)
+            if job.started is not None:
+                stage_seconds.labels(stage='job').observe(job.finished -
+                                                          job.started)
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+
+__all__ = ['dofs', 'forces', 'components', 'id_to_label', 'label_to_id']
+
+
+# nodal results
+dofs = UZ, ROTX, ROTY = list(range(3))
+# internal forces, smoothed from the elements to the nodes
+forces = MX, MY, MXY, VX, VY = list(range(3, 8))
+components = dofs + forces
+id_to_label = {UZ: 'UZ', ROTX: 'ROTX', ROTY: 'ROTY', MX: 'MX', MY: 'MY',
+               MXY: 'MXY', VX: 'VX', VY: 'VY'}
+label_to_id = {value: key for key, value in id_to_label.items()}
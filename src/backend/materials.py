@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+
+__all__ = ['materials']
+
+
+# modulus of elasticity [kN/m2] and Poisson's ratio of the concrete
+# classes of Eurocode 2
+materials = {
+    'C12/15': (27.0e6, 0.2),
+    'C16/20': (29.0e6, 0.2),
+    'C20/25': (30.0e6, 0.2),
+    'C25/30': (31.0e6, 0.2),
+    'C30/37': (33.0e6, 0.2),
+    'C35/45': (34.0e6, 0.2),
+    'C40/50': (35.0e6, 0.2),
+    'C45/55': (36.0e6, 0.2),
+    'C50/60': (37.0e6, 0.2),
+    'C55/67': (38.0e6, 0.2),
+    'C60/75': (39.0e6, 0.2),
+    'C70/85': (41.0e6, 0.2),
+    'C80/95': (42.0e6, 0.2),
+    'C90/105': (44.0e6, 0.2),
+}
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus metrics of the solver and of the web server.
+
+The metrics live in the default registry of `prometheus_client`, which
+is shared by the solver threads and the web server of a process. With
+several processes, set the environment variable PROMETHEUS_MULTIPROC_DIR
+to a folder, see the documentation of `prometheus_client`. With a solver
+daemon, app.py and daemon.py set it to the 'metrics' folder of the cache,
+so the stages solved and the restarts counted in the processes of the
+daemon are exposed by the app.
+"""
+import os
+from prometheus_client import Histogram, Counter, CollectorRegistry, \
+    generate_latest, CONTENT_TYPE_LATEST, multiprocess
+
+
+__all__ = ['stage_seconds', 'queue_wait_seconds', 'mesh_nodes',
+           'mesh_elements', 'com_calls', 'batch_cases', 'payload_bytes',
+           'cache_requests', 'cancelled_jobs', 'solver_restarts', 'timed',
+           'exposition']
+
+
+_seconds = (.01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 25., 60., 120.,
+            300.)
+_sizes = (1e2, 3e2, 1e3, 3e3, 1e4, 3e4, 1e5, 3e5, 1e6)
+
+
+stage_seconds = Histogram(
+    'axisvm_dash_stage_seconds',
+    'Duration of the stages of solving problems and presenting results.',
+    ['stage'], buckets=_seconds)
+queue_wait_seconds = Histogram(
+    'axisvm_dash_queue_wait_seconds',
+    'Time from the submission of a job until a solver picks it up.',
+    buckets=_seconds)
+mesh_nodes = Histogram(
+    'axisvm_dash_mesh_nodes', 'Number of nodes of the solved models.',
+    buckets=_sizes)
+mesh_elements = Histogram(
+    'axisvm_dash_mesh_elements', 'Number of elements of the solved models.',
+    buckets=_sizes)
+com_calls = Histogram(
+    'axisvm_dash_com_calls', 'Number of COM calls of a stage of a solve.',
+    ['stage'], buckets=_sizes)
+batch_cases = Histogram(
+    'axisvm_dash_batch_cases', 'Number of load cases solved in one model.',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+payload_bytes = Histogram(
+    'axisvm_dash_payload_bytes',
+    'Size of the responses of the callbacks before compression.',
+    ['output'], buckets=(1e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7))
+cache_requests = Counter(
+    'axisvm_dash_cache_requests',
+    'Submitted problems by how they were answered: from the cache (hit), '
+    'by scaling (scaled), from influence surfaces (influence), by '
+    'the solve of an identical problem in progress (coalesced) or by '
+    'a solver (miss).',
+    ['outcome'])
+cancelled_jobs = Counter(
+    'axisvm_dash_cancelled_jobs',
+    'Queued jobs dropped, because a newer job of the same client '
+    'superseded them.')
+solver_restarts = Counter(
+    'axisvm_dash_solver_restarts',
+    'Restarts of solvers by the reason: a dead AxisVM (axisvm), a dead '
+    'worker process (died) or a job running too long (timeout).',
+    ['reason'])
+
+
+def timed(stage):
+    """
+    Returns a context manager (also usable as a decorator) that records
+    the duration of a stage in `stage_seconds`.
+
+    Example
+    -------
+    >>> with timed('mesh'):
+    ...     coords, topo = generate_mesh(axmodel=axmodel, **params)
+    """
+    return stage_seconds.labels(stage=stage).time()
+
+
+def exposition():
+    """
+    Returns the metrics in the text format of Prometheus and the
+    content type of it.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
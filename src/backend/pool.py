@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from threading import Thread, RLock
+from queue import Queue
+import os
+import tempfile
+from .jobs import Sentinel
+
+
+__all__ = ['SolverPool']
+
+
+class SolverPool:
+    """
+    A pool of solver threads, each owning its own AxisVM instance.
+
+    Every worker has its own input queue and its own model file, while
+    the workers share a single output queue. Problems are dispatched
+    to the worker with the least outstanding jobs.
+
+    Parameters
+    ----------
+    n_workers : int, Optional
+        The number of workers. Default is 1.
+
+    target : callable, Optional
+        The solver function run by the workers. It is called with the
+        input queue, the output queue and a list for the material names,
+        see `solver`. Default is None, which means `solver`.
+
+    material_names : list, Optional
+        A list to be filled with the names of the materials in
+        the catalog by the first worker. Default is None.
+
+    filename : str, Optional
+        The scratch model files of the workers are named after this.
+        Default is 'DashModel.axs' in the folder of temporary files.
+
+    **kwargs : dict, Optional
+        Keyword arguments forwarded to `target`.
+    """
+
+    def __init__(self, n_workers=1, *args, target=None, material_names=None,
+                 filename=None, **kwargs):
+        if filename is None:
+            filename = os.path.join(tempfile.gettempdir(), 'DashModel.axs')
+        if target is None:
+            from .backend import solver as target
+        self.out_queue = Queue()
+        self.in_queues = [Queue() for _ in range(n_workers)]
+        self.load = [0 for _ in range(n_workers)]
+        name, ext = os.path.splitext(filename)
+        self.filenames = ['{}_{}{}'.format(name, i, ext)
+                          for i in range(n_workers)]
+        self._assigned = {}
+        self._lock = RLock()
+        if material_names is None:
+            material_names = []
+        self.workers = []
+        for i, in_queue in enumerate(self.in_queues):
+            names = material_names if i == 0 else []
+            worker = Thread(target=target,
+                            args=(in_queue, self.out_queue, names),
+                            kwargs=kwargs, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def __len__(self):
+        return len(self.workers)
+
+    def put(self, in_data):
+        """
+        Dispatches a `(job_id, params)` tuple to the least loaded worker.
+        """
+        job_id, params = in_data
+        with self._lock:
+            i = min(range(len(self.load)), key=self.load.__getitem__)
+            self.load[i] += 1
+            self._assigned[job_id] = i
+        params = dict(params, filename=self.filenames[i])
+        self.in_queues[i].put((job_id, params))
+
+    def release(self, job_id):
+        """
+        Marks a job as finished, to be called when its result arrives.
+        """
+        with self._lock:
+            i = self._assigned.pop(job_id, None)
+            if i is not None:
+                self.load[i] -= 1
+
+    def position(self, job_id):
+        """
+        Returns the number of jobs ahead of a job at its worker (the
+        ones being solved included), or None if the worker has already
+        picked it up.
+        """
+        with self._lock:
+            i = self._assigned.get(job_id, None)
+            if i is None:
+                return None
+            in_queue = self.in_queues[i]
+            with in_queue.mutex:
+                for k, in_data in enumerate(in_queue.queue):
+                    if not isinstance(in_data, Sentinel) and \
+                            in_data[0] == job_id:
+                        # the rest of the jobs of the worker are not queued
+                        return self.load[i] - len(in_queue.queue) + k
+        return None
+
+    def cancel(self, job_id):
+        """
+        Removes a job from the queue of its worker and returns True, or
+        returns False if the worker has already picked it up.
+        """
+        with self._lock:
+            i = self._assigned.get(job_id, None)
+            if i is None:
+                return False
+            in_queue = self.in_queues[i]
+            with in_queue.mutex:
+                for in_data in in_queue.queue:
+                    if not isinstance(in_data, Sentinel) and \
+                            in_data[0] == job_id:
+                        break
+                else:
+                    return False
+                in_queue.queue.remove(in_data)
+                # it is never marked done by the worker
+                in_queue.unfinished_tasks -= 1
+                if not in_queue.unfinished_tasks:
+                    in_queue.all_tasks_done.notify_all()
+            self.release(job_id)
+        return True
+
+    def health(self):
+        """
+        Returns the state of the workers as a list of dictionaries.
+        """
+        with self._lock:
+            return [{'worker': i, 'alive': worker.is_alive(),
+                     'jobs': self.load[i]}
+                    for i, worker in enumerate(self.workers)]
+
+    def close(self):
+        """
+        Stops the workers and waits for them to finish.
+        """
+        for in_queue in self.in_queues:
+            in_queue.put(Sentinel())
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Derivation of results from cached solutions of linear problems.
+
+The nodal results of a linear analysis are proportional to the load
+intensity `q`, so a problem that differs from a cached one only in `q`
+is solved exactly by scaling. For a plate in pure bending, the results
+are also proportional to 1/E and 1/t^3, while the internal forces do not
+change. This rule is used for changes of the material (with the same
+Poisson's ratio) and the thickness, and the results are flagged as
+approximate, since it ignores the shear deformation of the plate and the
+stiffness of the supports.
+"""
+import json
+import numpy as np
+from .cache import normalize_params
+from .labels import dofs
+from .materials import materials
+
+
+__all__ = ['scaling_indexes', 'scale_from_cache']
+
+
+def _family(params, paths):
+    # the canonical parameters without the given entries
+    params = normalize_params(params)
+    for path in paths:
+        keys = path.split('.')
+        d = params
+        for key in keys[:-1]:
+            d = d.get(key, {})
+        d.pop(keys[-1], None)
+    return json.dumps(params, sort_keys=True)
+
+
+def load_family(params):
+    return _family(params, ['load.q'])
+
+
+def stiffness_family(params):
+    return _family(params, ['load.q', 'material', 'thickness'])
+
+
+# secondary indexes of a ResultCache required by `scale_from_cache`
+scaling_indexes = {'load': load_family, 'stiffness': stiffness_family}
+
+
+def load_factor(source, params):
+    q0, q = float(source['load']['q']), float(params['load']['q'])
+    return None if q0 == 0 else q / q0
+
+
+def stiffness_factor(source, params):
+    if source['material'] not in materials or \
+            params['material'] not in materials:
+        return None
+    E0, nu0 = materials[source['material']]
+    E, nu = materials[params['material']]
+    if nu0 != nu:
+        return None
+    t0, t = float(source['thickness']), float(params['thickness'])
+    return E0 / E * (t0 / t)**3
+
+
+def scale_from_cache(cache, params, *args, approximate=True, **kwargs):
+    """
+    Returns a `(params, coords, topo, res2d)` result derived from a cached
+    solution by scaling and a dictionary describing the derivation, or
+    None if there is no suitable solution in the cache. The cache must
+    have been created with `scaling_indexes`.
+
+    Parameters
+    ----------
+    cache : ResultCache
+        The cache.
+
+    params : dict
+        The parameters of the problem.
+
+    approximate : bool, Optional
+        If False, only exact results are returned. Default is True.
+    """
+    if not all(name in cache.indexes for name in scaling_indexes):
+        return None
+    if 'load' not in params:
+        return None
+    rules = [('load', False)]
+    if approximate:
+        rules.append(('stiffness', True))
+    for name, approx in rules:
+        for key in cache.lookup(name, params):
+            entry = cache.get(key)
+            if entry is None:
+                continue
+            source, coords, topo, res2d = entry
+            factor = load_factor(source, params)
+            if factor is None:
+                continue
+            # the internal forces only depend on the load
+            factors = np.full(len(res2d), factor)
+            if approx:
+                sfactor = stiffness_factor(source, params)
+                if sfactor is None:
+                    continue
+                factors[dofs] *= sfactor
+            info = {'source': key, 'factor': float(factors[0]), 
+                    'approximate': approx}
+            return (params, coords, topo, res2d * factors[:, None]), info
+    return None
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Smoothing of element results to the nodes.
+
+Results that are only available per element (like the internal forces)
+are averaged at the nodes, weighted by the areas of the triangles meeting
+at the nodes. The averaging is a sparse linear operator, that depends only
+on the mesh, so it is built once and applied to all the components (and
+all the load cases) in a single matrix product.
+"""
+from scipy.sparse import csr_matrix
+import numpy as np
+
+
+__all__ = ['triangle_areas', 'smoothing_operator', 'smooth']
+
+
+def triangle_areas(coords, topo):
+    """
+    Returns the areas of the triangles of a mesh.
+    """
+    tri = np.asarray(topo)[:, :3]
+    xy = np.asarray(coords)[:, :2].astype(np.float64)
+    a, b, c = xy[tri[:, 0]], xy[tri[:, 1]], xy[tri[:, 2]]
+    return np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) -
+                  (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])) / 2
+
+
+def smoothing_operator(coords, topo):
+    """
+    Returns the area-weighted averaging operator of a triangle mesh, as
+    a sparse matrix of shape (N, 3 * nT), that maps values at the corners
+    of the triangles (flattened triangle by triangle) to the nodes.
+    """
+    nodes = np.asarray(topo)[:, :3].astype(np.int64).ravel()
+    weights = np.repeat(triangle_areas(coords, topo), 3)
+    total = np.bincount(nodes, weights=weights, minlength=len(coords))
+    total[total == 0] = 1.
+    return csr_matrix((weights / total[nodes], (nodes, np.arange(len(nodes)))),
+                      shape=(len(coords), len(nodes)))
+
+
+def smooth(operator, values):
+    """
+    Returns the nodal values of element results.
+
+    Parameters
+    ----------
+    operator : scipy.sparse.csr_matrix
+        The operator returned by `smoothing_operator`.
+
+    values : numpy.ndarray
+        The results with a shape of (..., nT) for constant values over
+        the triangles, or (..., nT, 3) for values at the corners.
+
+    Returns
+    -------
+    numpy.ndarray
+        The nodal values with a shape of (..., N).
+    """
+    n_corners = operator.shape[1]
+    values = np.asarray(values)
+    if values.shape[-1] * 3 == n_corners:
+        # the same value at the corners of a triangle
+        lead = values.shape[:-1]
+        values = np.repeat(values, 3, axis=-1)
+    else:
+        lead = values.shape[:-2]
+    values = values.reshape(-1, n_corners)
+    return (operator @ values.T).T.reshape(lead + (operator.shape[0],))
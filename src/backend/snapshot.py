@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+from .cache import param_hash
+
+
+__all__ = ['load_snapshot', 'save_snapshot']
+
+
+def load_snapshot(path, params, *args, cache=None, backend=None, **kwargs):
+    """
+    Returns the material names and the key of the cached result of the
+    problem `params` from a snapshot written by `save_snapshot`, or None
+    if there is no valid snapshot for the problem and the backend.
+
+    Parameters
+    ----------
+    path : str
+        The snapshot file.
+
+    params : dict
+        The parameters of the default problem.
+
+    cache : ResultCache, Optional
+        If provided, the snapshot is only valid if the result is in it.
+        Default is None.
+
+    backend : str, Optional
+        The name of the backend, the snapshot is only valid for the
+        backend it was written with. Default is None.
+    """
+    try:
+        with open(path, 'r') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    key = param_hash(params)
+    if snapshot.get('key', None) != key or \
+            snapshot.get('backend', None) != backend:
+        return None
+    if cache is not None and key not in cache:
+        return None
+    return snapshot['material_names'], key
+
+
+def save_snapshot(path, params, material_names, *args, backend=None,
+                  **kwargs):
+    """
+    Writes the material names and the key of the result of the problem
+    `params` (the result itself is expected to be in a `ResultCache`)
+    into a file, for a fast start next time.
+    """
+    snapshot = {'backend': backend, 'key': param_hash(params),
+                'material_names': list(material_names)}
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
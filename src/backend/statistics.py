@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics of the results, for the table of results.
+
+All the components are handled at once. The extrema are located at the
+nodes and the area-weighted means and integrals are evaluated with the
+lumped nodal areas of the triangles (a third of the area of every
+triangle to each of its corners), which is exact for the linear
+interpolation of the nodal values. The statistics of a result only
+depend on its content, so they are cached by the key of the result.
+"""
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+from .smoothing import triangle_areas
+
+
+__all__ = ['PERCENTILES', 'nodal_areas', 'result_statistics',
+           'get_statistics']
+
+
+# the percentiles in the statistics
+PERCENTILES = (5., 50., 95.)
+
+
+def nodal_areas(coords, topo):
+    """
+    Returns the lumped areas of the nodes of a triangle mesh.
+    """
+    nodes = np.asarray(topo)[:, :3].ravel()
+    weights = np.repeat(triangle_areas(coords, topo) / 3, 3)
+    return np.bincount(nodes, weights=weights, minlength=len(coords))
+
+
+def result_statistics(coords, topo, res2d, *args, percentiles=PERCENTILES,
+                      **kwargs):
+    """
+    Returns the statistics of the components of a result.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        The coordinates of the nodes.
+
+    topo : numpy.ndarray
+        The triangles of the mesh.
+
+    res2d : numpy.ndarray
+        The nodal values of the components with a shape of (nC, N).
+
+    percentiles : tuple, Optional
+        The percentiles of the nodal values. Default is `PERCENTILES`.
+
+    Returns
+    -------
+    dict
+        The statistics as arrays of the components: 'min' and 'max' with
+        their locations 'argmin' and 'argmax' (with a shape of (nC, 2)),
+        'mean', 'integral' and 'percentiles' (with a shape of (nC, nP)),
+        besides the 'area' of the plate and the 'q' of the percentiles.
+    """
+    res2d = np.asarray(res2d, dtype=np.float64)
+    xy = np.asarray(coords)[:, :2]
+    areas = nodal_areas(coords, topo)
+    area = areas.sum()
+    imin, imax = res2d.argmin(axis=-1), res2d.argmax(axis=-1)
+    rows = np.arange(len(res2d))
+    integral = res2d @ areas
+    return {
+        'min': res2d[rows, imin],
+        'max': res2d[rows, imax],
+        'argmin': xy[imin].astype(np.float64),
+        'argmax': xy[imax].astype(np.float64),
+        'mean': integral / area if area > 0 else np.full(len(res2d), np.nan),
+        'integral': integral,
+        'percentiles': np.percentile(res2d, percentiles, axis=-1).T,
+        'q': np.array(percentiles, dtype=np.float64),
+        'area': area,
+    }
+
+
+_statistics = OrderedDict()
+_lock = Lock()
+
+
+def get_statistics(key, coords, topo, res2d, *args, maxsize=64, **kwargs):
+    """
+    Returns the statistics of a result identified by `key`, they are only
+    evaluated if they were not requested recently.
+    """
+    key = (key, tuple(sorted(kwargs.items())))
+    with _lock:
+        if key in _statistics:
+            _statistics.move_to_end(key)
+            return _statistics[key]
+    statistics = result_statistics(coords, topo, res2d, **kwargs)
+    with _lock:
+        _statistics[key] = statistics
+        while len(_statistics) > maxsize:
+            _statistics.popitem(last=False)
+    return statistics
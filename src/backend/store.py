@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from threading import RLock
+import glob
+import os
+import shutil
+from .cache import param_hash
+
+
+__all__ = ['ModelStore', 'NEVER', 'ON_DEMAND', 'WRITE_BEHIND']
+
+
+# persistence policies of the models
+NEVER, ON_DEMAND, WRITE_BEHIND = 'never', 'on_demand', 'write_behind'
+
+
+class ModelStore:
+    """
+    A content-addressed store of model files.
+
+    Models are named after the hash of their parameters, so solving the
+    same problem twice keeps one file and concurrent solves of different
+    problems never write the same file. Above the retention limit the
+    least recently saved models are removed.
+
+    Parameters
+    ----------
+    directory : str
+        The folder of the models.
+
+    max_models : int, Optional
+        The maximum number of models kept. Default is 20.
+
+    ext : str, Optional
+        The extension of the files. Default is '.axs'.
+    """
+
+    def __init__(self, directory, *args, max_models=20, ext='.axs',
+                 **kwargs):
+        self.directory = directory
+        self.max_models = max_models
+        self.ext = ext
+        self._lock = RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, params):
+        """
+        Returns the path of the model of a problem or a key.
+        """
+        key = params if isinstance(params, str) else param_hash(params)
+        return os.path.join(self.directory, key + self.ext)
+
+    def __contains__(self, params):
+        return os.path.exists(self.path(params))
+
+    def put(self, params, source):
+        """
+        Copies the model file `source` into the store as the model of
+        `params` and returns its path.
+        """
+        path = self.path(params)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, path)
+        self._prune()
+        return path
+
+    def _prune(self):
+        with self._lock:
+            paths = glob.glob(os.path.join(self.directory, '*' + self.ext))
+            paths.sort(key=os.path.getmtime)
+            for path in paths[:max(len(paths) - self.max_models, 0)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # removed by another process
+                    pass
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+from copy import deepcopy
+from itertools import product
+import glob
+import json
+import os
+import time
+import warnings
+import numpy as np
+from .cache import normalize_params, param_hash
+from .jobs import DONE, FAILED
+
+
+__all__ = ['expand_sweep', 'run_sweep', 'NpzWriter', 'ParquetWriter']
+
+
+def set_path(params, path, value):
+    # sets a value in a nested dictionary, like 'load.xc'
+    keys = path.split('.')
+    d = params
+    for key in keys[:-1]:
+        d = d[key]
+    d[keys[-1]] = value
+
+
+def expand_sweep(spec):
+    """
+    Returns the list of parameter dictionaries of a sweep.
+
+    The specification is either a list of complete parameter dictionaries,
+    or a dictionary with the parameters of the base problem under 'base',
+    and a 'grid' and/or a 'variants' entry. A grid maps parameter paths
+    (like 'load.xc') to lists of values and means all the combinations of
+    them, while variants is a list of dictionaries of paths and values
+    to change in the base problem. If both are provided, every variant
+    is combined with every point of the grid.
+
+    Example
+    -------
+    >>> spec = {
+    ...     'base': params,
+    ...     'grid': {'load.xc': [2., 4., 6.], 'load.yc': [2., 4.]},
+    ... }
+    >>> len(expand_sweep(spec))
+    6
+    """
+    if isinstance(spec, list):
+        return [deepcopy(params) for params in spec]
+    base = spec['base']
+    grid = spec.get('grid', {})
+    variants = spec.get('variants', [{}])
+    paths = list(grid.keys())
+    res = []
+    for variant in variants:
+        for values in product(*[grid[path] for path in paths]):
+            params = deepcopy(base)
+            for path, value in variant.items():
+                set_path(params, path, value)
+            for path, value in zip(paths, values):
+                set_path(params, path, value)
+            res.append(params)
+    return res
+
+
+class NpzWriter:
+    """
+    Writes the results of a sweep into a folder, one NPZ file per variant,
+    named after the hash of the parameters. Every finished or failed
+    variant is recorded as a line of 'index.jsonl' in the folder.
+    """
+
+    def __init__(self, directory, *args, **kwargs):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index = os.path.join(directory, 'index.jsonl')
+        if os.path.exists(self.index):
+            with open(self.index, 'rb+') as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        # an interrupted run left a partial line
+                        f.write(b'\n')
+
+    def completed(self):
+        """
+        Returns the keys of the variants that are already written.
+        """
+        if not os.path.exists(self.index):
+            return set()
+        records = []
+        with open(self.index, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # a partial line of an interrupted run
+                    continue
+        return {r['key'] for r in records if r.get('status', None) == DONE}
+
+    def write(self, i, key, params, result=None, error=None):
+        if result is not None:
+            _, coords, topo, res2d = result
+            path = os.path.join(self.directory, key + '.npz')
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, params=json.dumps(normalize_params(params)),
+                         coords=coords, topo=topo, res2d=res2d)
+            os.replace(path + '.tmp', path)
+        record = {'index': i, 'key': key, 'params': normalize_params(params),
+                  'status': DONE if error is None else FAILED,
+                  'error': error}
+        with open(self.index, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """
+    Writes the results of a sweep into a folder of Parquet files, with
+    one row per node and one row group per variant. Every run writes
+    new part files of at most `variants_per_part` variants, so
+    interrupted runs can be resumed. A part is written under a temporary
+    name and renamed when it is complete, so a run that is killed only
+    loses the variants of its last part. Requires `pyarrow`.
+    """
+
+    def __init__(self, directory, *args, labels=None, variants_per_part=64,
+                 **kwargs):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa, self.pq = pa, pq
+        self.directory = directory
+        self.labels = labels
+        self.variants_per_part = variants_per_part
+        os.makedirs(directory, exist_ok=True)
+        self.prefix = 'part-{}-{}'.format(time.strftime('%Y%m%d%H%M%S'),
+                                          os.getpid())
+        self._parts = 0
+        self._variants = 0
+        self._writer = None
+
+    def _path(self):
+        name = '{}-{}.parquet'.format(self.prefix, self._parts)
+        return os.path.join(self.directory, name)
+
+    def completed(self):
+        keys = set()
+        for path in glob.glob(os.path.join(self.directory, '*.parquet')):
+            try:
+                table = self.pq.read_table(path, columns=['key'])
+            except Exception:
+                warnings.warn('Skipped the unreadable file {}.'.format(path))
+                continue
+            keys.update(table.column('key').unique().to_pylist())
+        for path in glob.glob(os.path.join(self.directory, 
+                                           '*.parquet.tmp')):
+            if not os.path.basename(path).startswith(self.prefix):
+                warnings.warn('Discarded {}, the unfinished part of an '
+                              'interrupted run, its variants are solved '
+                              'again.'.format(path))
+        return keys
+
+    def write(self, i, key, params, result=None, error=None):
+        if result is None:
+            return
+        _, coords, _, res2d = result
+        N = len(coords)
+        columns = {
+            'variant': np.full(N, i, dtype=np.int32),
+            'key': [key] * N,
+            'x': coords[:, 0],
+            'y': coords[:, 1],
+        }
+        labels = self.labels or ['res{}'.format(j) for j in range(len(res2d))]
+        for j, label in enumerate(labels):
+            columns[label] = res2d[j]
+        table = self.pa.table(columns)
+        if self._writer is None:
+            self._writer = self.pq.ParquetWriter(self._path() + '.tmp', 
+                                                 table.schema)
+        self._writer.write_table(table)
+        self._variants += 1
+        if self._variants >= self.variants_per_part:
+            self.close()
+
+    def close(self):
+        """
+        Completes the current part file.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            os.replace(self._path() + '.tmp', self._path())
+            self._writer = None
+            self._parts += 1
+            self._variants = 0
+
+
+def run_sweep(spec, jobs, writer, *args, resume=True, timeout=None,
+              callback=None, **kwargs):
+    """
+    Solves the variants of a sweep with a `JobManager` and writes the
+    results as they finish. All the variants are queued at once, so the
+    workers solve the variants that only differ in the load together,
+    see `serve`.
+
+    Parameters
+    ----------
+    spec : dict or list
+        The specification of the sweep, see `expand_sweep`.
+
+    jobs : JobManager
+        The variants are solved by the workers of its pool.
+
+    writer : NpzWriter or ParquetWriter
+        The output.
+
+    resume : bool, Optional
+        If True, the variants that are already in the output are skipped.
+        Default is True.
+
+    timeout : float, Optional
+        The maximum time to wait for any variant to finish. Default is None.
+
+    callback : callable, Optional
+        Called as `callback(i, job)` after every finished variant.
+
+    Returns
+    -------
+    dict
+        The number of the 'done', 'failed' and 'skipped' variants.
+    """
+    variants = expand_sweep(spec)
+    completed = writer.completed() if resume else set()
+    summary = {'done': 0, 'failed': 0, 'skipped': 0}
+    index = {}
+    for i, params in enumerate(variants):
+        if param_hash(params) in completed:
+            summary['skipped'] += 1
+            continue
+        # finished jobs may be forgotten by the manager, keep them here,
+        # identical variants share a job
+        index.setdefault(jobs[jobs.submit(params)], []).append(i)
+    try:
+        for job in jobs.as_completed(list(index.keys()), timeout=timeout):
+            for i in index[job]:
+                # the variants are named after the problem, also if the
+                # result of a batch has a key of its own
+                key = param_hash(variants[i])
+                if job.status == DONE:
+                    writer.write(i, key, variants[i], result=job.result)
+                    summary['done'] += 1
+                else:
+                    writer.write(i, key, variants[i], error=job.error)
+                    summary['failed'] += 1
+                if callback is not None:
+                    callback(i, job)
+    finally:
+        writer.close()
+    return summary
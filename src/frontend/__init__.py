@@ -1,3 +1,6 @@
 # -*- coding: utf-8 -*-
 from src.frontend.components import layout, gen_table_data
-from src.frontend.plotting import fig2d, fig3d
\ No newline at end of file
+from src.frontend.plotting import fig2d, fig3d, fig2d_data, \
+    mesh_preview_data
+from src.frontend.resample import GridInterpolator, get_interpolator
+from src.frontend.encoding import encode_array, decode_array
@@ -2,9 +2,9 @@
 import dash_bootstrap_components as dbc
 from dash import dcc, html, dash_table
 import plotly.graph_objects as go
-import pandas as pd
+import numpy as np
 from .utils import float_to_str_sig
-from ..backend import dofs, id_to_label, label_to_id
+from ..backend import components, id_to_label, label_to_id, PERCENTILES
 
 
 __all__ = ['layout', 'gen_table_data']
@@ -19,11 +19,20 @@ def input_res(**params):
             html.P('Component'),
             dcc.Dropdown(
                 id='component',
-                options=[{'label': id_to_label[dof],
-                          'value': id_to_label[dof]}
-                         for dof in dofs],
+                options=[{'label': id_to_label[comp],
+                          'value': id_to_label[comp]}
+                         for comp in components],
                 value='UZ'
             ),
+            # the 3d view shows the deformed shape, it is drawn on the server
+            dbc.RadioItems(
+                id='view',
+                options=[{'label': '2D', 'value': '2d'},
+                         {'label': '3D', 'value': '3d'}],
+                value='2d',
+                inline=True,
+                className='mt-2'
+            ),
         ]
     )
 
@@ -165,6 +174,14 @@ def input_load(**params):
                 ],
                 className="mb-3",
             ),
+            # makes moving the patch instant for approximate results
+            dbc.Button(
+                "Precompute influence surfaces",
+                id='precompute_button',
+                color="secondary",
+                outline=True,
+                size="sm"
+            ),
         ]
     )
 
@@ -184,6 +201,12 @@ def input_mesh(**params):
                 ],
                 className="mb-3",
             ),
+            # refines the mesh until the results converge
+            dbc.Checkbox(
+                id='converge',
+                label="Find the mesh size automatically",
+                value=False
+            ),
         ]
     )
     
@@ -226,29 +249,78 @@ def input_panel(**params):
                 ],
             ),
             html.Br(),
+            dbc.Checkbox(
+                id='approximate',
+                label="Allow approximate results",
+                value=True
+            ),
+            html.Br(),
             dbc.Button(
                 "Calculate",
                 id='calc_button',
                 color="primary"
-            )
+            ),
+            # only shown if the models can be saved
+            dbc.Button(
+                "Save model",
+                id='save_button',
+                color="secondary",
+                outline=True,
+                className="ms-2",
+                style=None if params.get('can_save', False) else 
+                {'display': 'none'}
+            ),
+            html.P(id='status', className="mt-3"),
+            # the running job and the key of the result of the session,
+            # the results themselves are kept on the server
+            dcc.Store(id='job', storage_type='session'),
+            # the progress of the running job, streamed from the server
+            dcc.Store(id='progress'),
+            dcc.Store(id='result', storage_type='session',
+                      data=params.get('result_key', None)),
+            dcc.Interval(id='poll', interval=500, disabled=True),
         ]
     )
     
 
-def gen_table_data(*args, res2d=None, sig=6, atol=1e-10, **kwargs):
-    def pprint(x): return float_to_str_sig(x, sig=sig, atol=atol)
+# the columns of the table of results
+TABLE_COLUMNS = ['', 'min', 'at min', 'max', 'at max', 'mean', 'integral'] + \
+    ['p{:g}'.format(q) for q in PERCENTILES]
+
+
+def gen_table_data(*args, stats=None, sig=6, atol=1e-10, **kwargs):
+    """
+    Returns the rows of the table of results as a list of dictionaries,
+    from the statistics returned by `src.backend.get_statistics`. All
+    the values are 'nan' without statistics.
+    """
+    if stats is None:
+        return [dict(zip(TABLE_COLUMNS, [comp] + ['nan'] * 
+                         (len(TABLE_COLUMNS) - 1))) for comp in label_to_id]
+    labels = [id_to_label[i] for i in range(len(stats['min']))]
+    values = np.column_stack([stats['min'], stats['max'], stats['mean'], 
+                              stats['integral'], stats['percentiles']])
+    values = np.reshape(float_to_str_sig(values.ravel(), sig=sig, 
+                                         atol=atol), values.shape).tolist()
+    xy = np.concatenate([stats['argmin'], stats['argmax']], axis=1)
+    xy = np.reshape(float_to_str_sig(xy.ravel(), sig=3), xy.shape).tolist()
     tbldata = []
-    if res2d is not None:
-        for comp, ind in label_to_id.items():
-            tbldata.append([comp, 
-                            pprint(res2d[ind].min()), 
-                            pprint(res2d[ind].max())])
-    else:
-        for comp, ind in label_to_id.items():
-            tbldata.append([comp, 'nan', 'nan'])
-    return pd.DataFrame(tbldata, columns=['', 'min', 'max'])
+    for label, row, (x0, y0, x1, y1) in zip(labels, values, xy):
+        tbldata.append(dict(zip(TABLE_COLUMNS, 
+            [label, row[0], '({}, {})'.format(x0, y0), row[1], 
+             '({}, {})'.format(x1, y1), *row[2:]])))
+    return tbldata
     
 
+def export_links():
+    # the addresses are set by a callback, see `/export` in app.py
+    links = [html.Span('Export the result as ')]
+    for fmt, label in (('npz', 'NPZ'), ('vtk', 'VTK'), ('csv', 'CSV')):
+        links.append(html.A(label, id='export_' + fmt, download='', 
+                            className='ms-2'))
+    return html.Div(links, className='mt-3')
+
+
 def navigation_bar(*args, logo_src=None, **params):
     nav_item = dbc.NavItem(dbc.NavLink("Link", href="#"))
     dropdown = dbc.DropdownMenu(
@@ -323,8 +395,9 @@ def navigation_bar(*args, logo_src=None, **params):
 
 def layout(*args, logo_src=None, **params):
     # total width is 12 units
-    table_data = gen_table_data(**params)
-    columns=[{"name": i, "id": i} for i in table_data.columns]
+    # placeholder rows, the results are filled in by a callback
+    table_data = gen_table_data()
+    columns=[{"name": i, "id": i} for i in TABLE_COLUMNS]
     return html.Div(
         children =
             [
@@ -342,11 +415,15 @@ def layout(*args, logo_src=None, **params):
                             dbc.Col(
                                 [
                                     dcc.Graph(id='plot', figure=go.Figure()),
+                                    # all the components of the result,
+                                    # the plot is drawn in the browser
+                                    dcc.Store(id='fields'),
                                     dash_table.DataTable(
                                         id='table', 
-                                        data=table_data.to_dict('records'),
+                                        data=table_data,
                                         columns=columns,
                                     ),
+                                    export_links(),
                                 ],
                                 width=9
                                 ),
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import base64
+import numpy as np
+
+
+__all__ = ['encode_array', 'decode_array']
+
+
+def encode_array(value, *args, dtype=np.float32, **kwargs):
+    """
+    Returns a JSON serializable representation of an array as a
+    base64-encoded little-endian typed array. The result is decoded
+    in the browser by `decode` in assets/clientside.js.
+
+    Parameters
+    ----------
+    value : numpy.ndarray
+        The array to encode.
+
+    dtype : numpy.dtype, Optional
+        The type of the encoded data. Default is float32, which is
+        enough for displaying results.
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys 'dtype', 'shape' and 'bdata'.
+    """
+    dtype = np.dtype(dtype).newbyteorder('<')
+    value = np.ascontiguousarray(value, dtype=dtype)
+    return {
+        'dtype': value.dtype.str[1:],
+        'shape': list(value.shape),
+        'bdata': base64.b64encode(value.tobytes()).decode('ascii'),
+    }
+
+
+def decode_array(data):
+    """
+    The inverse of `encode_array`.
+    """
+    value = np.frombuffer(base64.b64decode(data['bdata']),
+                          dtype='<' + data['dtype'])
+    return value.reshape(data['shape'])
@@ -1,18 +1,117 @@
 # -*- coding: utf-8 -*-
-import plotly.figure_factory as ff
+import numpy as np
 import plotly.graph_objects as go
+from .resample import GridInterpolator
+from .encoding import encode_array
 
 
-def fig3d(coords, triangles, res2d, cmap="Viridis", **params):
+def decimate(coords, topo, values, max_elements):
+    """
+    Returns a coarser version of a triangle mesh with at most about
+    `max_elements` triangles, by clustering the nodes on a regular grid.
+    The nodes of a cluster are merged into their centroid with the mean
+    of their values, degenerate and duplicate triangles are dropped.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        The coordinates of the nodes.
+
+    topo : numpy.ndarray
+        The triangles of the mesh.
+
+    values : numpy.ndarray
+        Nodal values with a shape of (..., N).
+
+    Returns
+    -------
+    tuple
+        The coordinates (only x and y), the triangles and the values of
+        the coarse mesh.
+    """
+    xy = np.asarray(coords)[:, :2].astype(np.float64)
+    tri = np.asarray(topo)[:, :3]
+    values = np.asarray(values)
+    if len(tri) <= max_elements:
+        return xy, tri, values
+    lo, hi = xy.min(axis=0), xy.max(axis=0)
+    # two triangles per cell of the grid
+    h = np.sqrt(2 * np.prod(np.maximum(hi - lo, 1e-12)) / max_elements)
+    cells = np.floor((xy - lo) / h).astype(np.int64)
+    cells = cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1]
+    clusters, nodes = np.unique(cells, return_inverse=True)
+    n = len(clusters)
+    count = np.bincount(nodes, minlength=n)
+    def mean(v): return np.bincount(nodes, weights=v, minlength=n) / count
+    xy = np.column_stack([mean(xy[:, 0]), mean(xy[:, 1])])
+    lead = values.shape[:-1]
+    flat = values.reshape(-1, values.shape[-1])
+    values = np.array([mean(v) for v in flat]).reshape(lead + (n,))
+    tri = nodes[tri]
+    keep = (tri[:, 0] != tri[:, 1]) & (tri[:, 1] != tri[:, 2]) & \
+        (tri[:, 2] != tri[:, 0])
+    tri = tri[keep]
+    # triangles with the same nodes have the same key
+    a, b, c = np.sort(tri, axis=1).T
+    _, first = np.unique((a * n + b) * n + c, return_index=True)
+    return xy, tri[np.sort(first)], values
+
+
+def fig3d(coords, triangles, res2d, *args, uz=None, scale=None,
+          max_elements=None, cmap="Viridis", **params):
+    """
+    Returns a WebGL figure of the (deformed) plate, coloured by the
+    nodal values `res2d`.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        The coordinates of the nodes.
+
+    triangles : numpy.ndarray
+        The triangles of the mesh.
+
+    res2d : numpy.ndarray
+        The values at the nodes to colour the surface with.
+
+    uz : numpy.ndarray, Optional
+        The vertical displacements of the nodes. If provided, the
+        deformed shape is drawn. Default is None.
+
+    scale : float, Optional
+        The scale factor of the displacements. Default is None, which
+        means that the largest displacement is drawn as a tenth of the
+        longer side of the plate.
+
+    max_elements : int, Optional
+        If provided, larger meshes are decimated to about this number
+        of triangles, see `decimate`. Default is None.
+
+    **params : dict
+        The side lengths of the plate as 'Lx' and 'Ly'.
+    """
     Lx = params['Lx']
     Ly = params['Ly']
-    aspects = {'x': 1.0, 'y': Ly/Lx, 'z': 1.0}
-    fig = ff.create_trisurf(x=coords[:, 0], y=coords[:, 1], z=coords[:, 2],
-                            simplices=triangles, color_func=res2d,
-                            colormap=cmap, title='',
-                            aspectratio=aspects, showbackground=True)
+    values = np.asarray(res2d)[None, :]
+    if uz is not None:
+        values = np.concatenate([values, np.asarray(uz)[None, :]])
+    if uz is not None and scale is None:
+        umax = np.abs(values[1]).max()
+        scale = 0. if umax == 0 else 0.1 * max(Lx, Ly) / umax
+    xy, tri = np.asarray(coords)[:, :2], np.asarray(triangles)[:, :3]
+    if max_elements is not None:
+        xy, tri, values = decimate(xy, tri, values, max_elements)
+    z = scale * values[1] if uz is not None else np.zeros(len(xy))
+    fig = go.Figure(go.Mesh3d(
+        x=xy[:, 0], y=xy[:, 1], z=z, i=tri[:, 0], j=tri[:, 1], k=tri[:, 2],
+        intensity=values[0], intensitymode='vertex', colorscale=cmap,
+        flatshading=False, hoverinfo='skip'))
     fig.update_layout(transition_duration=500,
                       scene=dict(
+                          aspectmode='data',
+                          xaxis=dict(visible=False),
+                          yaxis=dict(visible=False),
+                          zaxis=dict(visible=False),
                           annotations=[
                               dict(
                                   showarrow=False,
@@ -68,13 +167,18 @@ def fig3d(coords, triangles, res2d, cmap="Viridis", **params):
     return fig
 
 
-def fig2d(coords, res2d, **params):
+def fig2d(coords, topo, res2d, *args, interpolator=None, resolution=200, 
+          **params):
+    # the nodal values are resampled on a regular grid using the topology,
+    # the size of the figure depends on the resolution, not on the mesh
+    if interpolator is None:
+        interpolator = GridInterpolator(coords, topo, resolution=resolution)
     zmin = res2d.min()
     zmax = res2d.max()
     fig = go.Figure(data=go.Contour(
-        x=coords[:, 0],
-        y=coords[:, 1],
-        z=res2d,
+        x=interpolator.x,
+        y=interpolator.y,
+        z=interpolator(res2d),
         zmin=zmin, zmax=zmax
     ))
     fig['layout']['xaxis']['showticklabels'] = False
@@ -82,4 +186,45 @@ def fig2d(coords, res2d, **params):
     fig['layout']['yaxis']['showticklabels'] = False
     fig['layout']['paper_bgcolor']= 'white'
     fig['layout']['plot_bgcolor'] = 'white'
-    return fig
\ No newline at end of file
+    return fig
+
+
+def fig2d_data(coords, topo, res2d, labels, *args, interpolator=None, 
+               resolution=200, **params):
+    """
+    Returns all the components of a result resampled on a regular grid,
+    as base64-encoded float32 arrays for drawing `fig2d` in the browser.
+    """
+    if interpolator is None:
+        interpolator = GridInterpolator(coords, topo, resolution=resolution)
+    grid = interpolator(res2d)
+    return {
+        'x': encode_array(interpolator.x),
+        'y': encode_array(interpolator.y),
+        'z': {label: encode_array(grid[i]) 
+              for i, label in enumerate(labels)},
+        'zmin': {label: float(res2d[i].min()) 
+                 for i, label in enumerate(labels)},
+        'zmax': {label: float(res2d[i].max()) 
+                 for i, label in enumerate(labels)},
+    }
+
+
+def mesh_preview_data(coords, topo, *args, max_elements=20000, **params):
+    """
+    Returns the edges of the triangles of a mesh as polylines separated
+    by NaNs, as base64-encoded float32 arrays for drawing a preview of
+    the mesh in the browser. Large meshes are thinned out to at most
+    `max_elements` triangles.
+    """
+    tri = np.asarray(topo)[:, :3]
+    if len(tri) > max_elements:
+        tri = tri[::-(-len(tri) // max_elements)]
+    edges = np.sort(tri[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    edges = np.unique(edges, axis=0)
+    xy = np.asarray(coords)[:, :2]
+    gaps = np.full((len(edges), 1), np.nan)
+    return {
+        'x': encode_array(np.hstack([xy[edges, 0], gaps]).ravel()),
+        'y': encode_array(np.hstack([xy[edges, 1], gaps]).ravel()),
+    }
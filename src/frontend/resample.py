@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+
+
+__all__ = ['GridInterpolator', 'get_interpolator']
+
+
+class GridInterpolator:
+    """
+    Linear interpolation of nodal values of a triangular mesh onto
+    a regular grid.
+
+    The point location (the triangle and the barycentric coordinates of
+    every grid point) is calculated once, in a vectorized manner, and
+    the interpolation of a field is a single gather and sum after that.
+    Grid points outside of the mesh get NaN values.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        Coordinates of the nodes, the first two columns are used.
+
+    topo : numpy.ndarray
+        Node indices of the triangles, the first three columns are used.
+
+    resolution : int, Optional
+        Number of grid points along the longer side of the bounding box
+        of the mesh, the other side is sampled with the same spacing.
+        Default is 200.
+
+    shape : tuple, Optional
+        The number of grid points in the x and y directions. If provided,
+        `resolution` is ignored. Default is None.
+    """
+
+    def __init__(self, coords, topo, *args, resolution=200, shape=None,
+                 **kwargs):
+        xy = np.asarray(coords)[:, :2]
+        tri = np.asarray(topo)[:, :3].astype(np.int64)
+        (xmin, ymin), (xmax, ymax) = xy.min(axis=0), xy.max(axis=0)
+        if shape is None:
+            d = max(xmax - xmin, ymax - ymin) / (resolution - 1)
+            shape = (int(round((xmax - xmin) / d)) + 1,
+                     int(round((ymax - ymin) / d)) + 1)
+        nx, ny = shape
+        self.shape = (ny, nx)
+        self.x = np.linspace(xmin, xmax, nx)
+        self.y = np.linspace(ymin, ymax, ny)
+        dx = (xmax - xmin) / max(nx - 1, 1)
+        dy = (ymax - ymin) / max(ny - 1, 1)
+        eps = 1e-9
+
+        # grid points in the bounding boxes of the triangles
+        P = xy[tri]  # (nT, 3, 2)
+        i0 = np.ceil((P[:, :, 0].min(axis=1) - xmin) / dx - eps).astype(int)
+        i1 = np.floor((P[:, :, 0].max(axis=1) - xmin) / dx + eps).astype(int)
+        j0 = np.ceil((P[:, :, 1].min(axis=1) - ymin) / dy - eps).astype(int)
+        j1 = np.floor((P[:, :, 1].max(axis=1) - ymin) / dy + eps).astype(int)
+        i0, j0 = np.maximum(i0, 0), np.maximum(j0, 0)
+        ni = np.maximum(np.minimum(i1, nx - 1) - i0 + 1, 0)
+        nj = np.maximum(np.minimum(j1, ny - 1) - j0 + 1, 0)
+        counts = ni * nj
+        t = np.repeat(np.arange(len(tri)), counts)
+        starts = np.cumsum(counts) - counts
+        offset = np.arange(counts.sum()) - np.repeat(starts, counts)
+        ii = i0[t] + offset % ni[t]
+        jj = j0[t] + offset // ni[t]
+
+        # barycentric coordinates of the candidates
+        a, b, c = P[t, 0], P[t, 1], P[t, 2]
+        px, py = self.x[ii] - a[:, 0], self.y[jj] - a[:, 1]
+        ux, uy = b[:, 0] - a[:, 0], b[:, 1] - a[:, 1]
+        vx, vy = c[:, 0] - a[:, 0], c[:, 1] - a[:, 1]
+        det = ux * vy - uy * vx
+        l1 = (px * vy - py * vx) / det
+        l2 = (ux * py - uy * px) / det
+        l0 = 1 - l1 - l2
+        W = np.stack([l0, l1, l2], axis=1)
+        inside = np.all(W > -eps, axis=1)
+
+        # a grid point on a shared edge belongs to the first triangle
+        index, first = np.unique((jj * nx + ii)[inside], return_index=True)
+        self.index = index
+        self.nodes = tri[t[inside][first]]
+        self.weights = W[inside][first]
+
+    def __call__(self, values):
+        """
+        Returns the interpolated values on the grid, with shape (ny, nx)
+        for a single field of shape (N,), or (k, ny, nx) for k fields.
+        """
+        values = np.asarray(values)
+        lead = values.shape[:-1]
+        res = np.full(lead + (self.shape[0] * self.shape[1],), np.nan)
+        res[..., self.index] = (values[..., self.nodes] * self.weights).sum(-1)
+        return res.reshape(lead + self.shape)
+
+
+_interpolators = OrderedDict()
+_lock = Lock()
+
+
+def get_interpolator(key, coords, topo, *args, maxsize=16, **kwargs):
+    """
+    Returns the interpolator of a mesh identified by `key`, it is only
+    created if it was not requested recently.
+    """
+    key = (key, tuple(sorted(kwargs.items())))
+    with _lock:
+        if key in _interpolators:
+            _interpolators.move_to_end(key)
+            return _interpolators[key]
+    interpolator = GridInterpolator(coords, topo, **kwargs)
+    with _lock:
+        _interpolators[key] = interpolator
+        while len(_interpolators) > maxsize:
+            _interpolators.popitem(last=False)
+    return interpolator